@@ -3,16 +3,21 @@ from collections import deque
 
 import numpy as np
 from scipy import interpolate
-import matplotlib.pyplot as plt
 
 from tegaki.character import *
 
 
 class FeatureExtractor():
-	def __init__(self, arc_len=30, curve_length_num=500, vecinity_reach=3):
+	def __init__(self, arc_len=30, curve_length_num=500, vecinity_reach=3, equal_arc_spacing=False):
+		"""
+		@param equal_arc_spacing: resample the strokes at equal arc length
+		                          instead of at equal spline parameter steps,
+		                          the networks are trained without it
+		"""
 		self.arc_len = arc_len
 		self.curve_length_num = curve_length_num
 		self.vecinity_reach = vecinity_reach
+		self.equal_arc_spacing = equal_arc_spacing
 		self.feature_order = ['pen_down', 'x', 'y',
 		                      'wr_cos', 'wr_sin',
 		                      'curv_cos', 'curv_sin',
@@ -46,6 +51,17 @@ class FeatureExtractor():
 			else:
 				self.active_features[feature_name] = False
 
+	def get_fingerprint(self):
+		"""
+		Identifies the configuration the extracted features depend on.
+
+		@rtype: str
+		"""
+		mask = "".join("1" if self.active_features[feature_name] else "0"
+		               for feature_name in self.feature_order)
+		return "arc_len=%r curve_length_num=%r vecinity_reach=%r equal_arc_spacing=%r features=%s" % \
+		       (self.arc_len, self.curve_length_num, self.vecinity_reach, self.equal_arc_spacing, mask)
+
 	def curve_length(self, x, y):
 		"""
 		Length of the curve determined by the points.
@@ -69,12 +85,36 @@ class FeatureExtractor():
 
 		@type x, y: np.array of ints
 		"""
-		num = int(self.curve_length(x, y) / self.arc_len)
+		return self.resample_curve(x, y)[:2]
+
+	def resample_curve(self, x, y):
+		"""
+		Same as L{resample_points}, also returning the length of the curve
+		the number of resampled points is computed from.
+
+		@type x, y: np.array of ints
+		@rtype: (xs, ys, length)
+		"""
 		if len(x) > 3:
+			# fit the spline once for both its length and the resampling
 			tck, u = interpolate.splprep([x, y], s=0.0)
-			x_i, y_i = interpolate.splev(np.linspace(0, 1, num), tck)
-			x, y = x_i, y_i
-		elif len(x) == 3:
+			u_i = np.linspace(0, 1, self.curve_length_num)
+			x_i, y_i = interpolate.splev(u_i, tck)
+			# same length as curve_length, summed in the same order
+			lengths = np.zeros(len(u_i))
+			np.cumsum(np.sqrt(np.diff(x_i) ** 2 + np.diff(y_i) ** 2), out=lengths[1:])
+			num = int(int(lengths[-1]) / self.arc_len)
+
+			if self.equal_arc_spacing:
+				u_resampled = np.interp(np.linspace(0, lengths[-1], num), lengths, u_i)
+			else:
+				u_resampled = np.linspace(0, 1, num)
+			x, y = interpolate.splev(u_resampled, tck)
+			return x, y, lengths[-1]
+
+		length = self.curve_length(x, y)
+		num = int(length / self.arc_len)
+		if len(x) == 3:
 			xs = np.linspace(x[0], x[1], num + 2, endpoint=True).tolist()
 			ys = np.linspace(y[0], y[1], num + 2, endpoint=True).tolist()
 			xs.extend(np.linspace(x[1], x[2], num + 2, endpoint=True).tolist()[1:])
@@ -85,7 +125,7 @@ class FeatureExtractor():
 			ys = np.linspace(y[0], y[1], num + 2, endpoint=True)
 			x, y = xs, ys
 
-		return x, y
+		return x, y, length
 
 	def resample_strokes(self, strokes):
 		"""
@@ -94,23 +134,99 @@ class FeatureExtractor():
 		@type strokes: L{tegaki.Stroke}
 		@rtype: list of (xs, ys) for each stroke
 		"""
+		return self.resample_arrays([map(np.array, zip(*[point.get_coordinates() for point in stroke]))
+		                             for stroke in strokes])
+
+	def resample_arrays(self, strokes):
+		"""
+		Resample each stroke.
+
+		@type strokes: list of (xs, ys) np.arrays
+		@rtype: list of (xs, ys) lists for each stroke
+		"""
 		strokes_coords = []
-		for stroke in strokes:
-			# remove duplicate points in stroke
-			p_set = set()  # set of points
-			p_uniq = []
-			for point in stroke:
-				point = point.get_coordinates()
-				if point not in p_set:
-					p_set.add(point)
-					p_uniq.append(point)
-
-			xs, ys = map(np.array, zip(*p_uniq))
-			xs, ys = self.resample_points(xs, ys)
+		for xs, ys in strokes:
+			xs, ys = self.resample_points(*FeatureExtractor.remove_duplicate_points(xs, ys))
 			strokes_coords.append((xs.tolist(), ys.tolist()))
 
 		return strokes_coords
 
+	@staticmethod
+	def remove_duplicate_points(xs, ys):
+		"""
+		Remove the duplicate points of a stroke, keeping the first ones.
+
+		@type xs, ys: np.array
+		@rtype: (xs, ys)
+		"""
+		_, first = np.unique(np.column_stack((xs, ys)), axis=0, return_index=True)
+		first.sort()
+		return xs[first], ys[first]
+
+	@staticmethod
+	def smooth_coordinates(a):
+		"""
+		Vectorized L{tegaki.character.Stroke.smooth} of int coordinates.
+
+		Three passes of the [1, 1, 2, 1, 1] moving average,
+		rounded down, end points are not affected.
+
+		@type a: np.array of ints
+		@rtype: np.array of ints
+		"""
+		weights = np.array([1, 1, 2, 1, 1])
+		if len(a) < len(weights):
+			return a
+		a = a.copy()
+		for _ in range(3):
+			a[2:-2] = np.convolve(a, weights, mode='valid') // weights.sum()
+		return a
+
+	@staticmethod
+	def normalize_arrays(writing, box_size=300):
+		"""
+		Return the coordinates of each stroke of the writing after
+		crop_to_mbr, fit_to_box, normalize_position and smooth,
+		with the same int rounding.
+
+		@type writing: tegaki.character.Writing or tegaki.character.ArrayWriting
+		@rtype: list of (xs, ys) np.arrays of ints
+		"""
+		if isinstance(writing, ArrayWriting):
+			if writing.get_n_points() == 0:
+				raise ValueError("empty writing")
+			xs, ys, offsets = writing.get_coordinate_arrays()
+			all_coordinates = np.column_stack((np.frombuffer(xs, dtype=np.float64),
+			                                   np.frombuffer(ys, dtype=np.float64)))
+			coordinates = np.split(all_coordinates, offsets[1:-1])
+			smoothed = writing.get_smoothed_strokes()
+		else:
+			strokes = writing.get_strokes(full=True)
+			coordinates = [np.array([(point['x'], point['y']) for point in stroke]).reshape(-1, 2)
+			               for stroke in strokes]
+			smoothed = [stroke.get_is_smoothed() for stroke in strokes]
+			if not any(len(stroke_coordinates) for stroke_coordinates in coordinates):
+				raise ValueError("empty writing")
+			all_coordinates = np.concatenate(coordinates)
+		xmin, ymin = all_coordinates.min(axis=0)
+		width, height = all_coordinates.max(axis=0) - (xmin, ymin)
+
+		# Writing.fit_to_box, then normalize_position of the int coordinates
+		hrate = box_size / float(height)
+		wrate = box_size / float(width)
+		rate = hrate if hrate * width < box_size else wrate
+		dx = (box_size - int(width * rate)) // 2
+		dy = (box_size - int(height * rate)) // 2
+
+		normalized = []
+		for stroke_coordinates, is_smoothed in zip(coordinates, smoothed):
+			xs = np.trunc((stroke_coordinates[:, 0] - xmin) * rate).astype(np.int64) + dx
+			ys = np.trunc((stroke_coordinates[:, 1] - ymin) * rate).astype(np.int64) + dy
+			if not is_smoothed:
+				xs = FeatureExtractor.smooth_coordinates(xs)
+				ys = FeatureExtractor.smooth_coordinates(ys)
+			normalized.append((xs, ys))
+		return normalized
 
 	def connect_stroke_endpoints(self, strokes_coords):
 		"""
@@ -256,23 +372,277 @@ class FeatureExtractor():
 		liniarity /= len(v)
 		return aspect, cos_slope, sin_slope, curliness, liniarity
 
+	@staticmethod
+	def writing_directions(x, y):
+		"""
+		Vectorized L{writing_direction} of every point.
+
+		@type x, y: np.array of floats
+		@rtype: (len(x), 2) np.array of cos and sin
+		"""
+		dx = np.abs(np.diff(x))
+		dy = np.abs(np.diff(y))
+		d = np.sqrt(dx ** 2 + dy ** 2)
+		nonzero = d != 0
+
+		directions = np.zeros((len(x), 2))
+		directions[-1] = 1.0, 0.0
+		directions[:-1][nonzero, 0] = dx[nonzero] / d[nonzero]
+		directions[:-1][nonzero, 1] = dy[nonzero] / d[nonzero]
+		return directions
+
+	@staticmethod
+	def curvatures(x, y):
+		"""
+		Vectorized L{curvature} of every point with its next and previous points.
+
+		@type x, y: np.array of floats
+		@rtype: (len(x), 2) np.array of cos and sin
+		"""
+		curvatures = np.zeros((len(x), 2))
+		curvatures[:, 0] = 1.0
+		if len(x) < 3:
+			return curvatures
+
+		# a is the vertex, b the next point and c the previous one
+		x_a, y_a = x[1:-1], y[1:-1]
+		x_b, y_b = x[2:], y[2:]
+		x_c, y_c = x[:-2], y[:-2]
+		d_ab = np.sqrt((x_a - x_b) ** 2 + (y_a - y_b) ** 2)
+		d_ac = np.sqrt((x_a - x_c) ** 2 + (y_a - y_c) ** 2)
+		d_bc = np.sqrt((x_b - x_c) ** 2 + (y_b - y_c) ** 2)
+
+		nonzero = (d_ab != 0) & (d_ac != 0)
+		cos_curv = np.ones(len(x_a))
+		cos_curv[nonzero] = (d_ab[nonzero] ** 2 + d_ac[nonzero] ** 2 - d_bc[nonzero] ** 2) / \
+		                    (2 * d_ab[nonzero] * d_ac[nonzero])
+		# curvature() takes the angle as pi and its cos as 1 when acos fails
+		out_of_domain = np.abs(cos_curv) > 1
+		ang = np.arccos(np.where(out_of_domain, 1.0, cos_curv))
+		ang[out_of_domain] = math.pi
+		cos_curv[out_of_domain] = 1.0
+
+		curvatures[1:-1, 0] = cos_curv
+		curvatures[1:-1, 1] = np.sin(ang)
+
+		# on straight lines, whether acos fails depends on the last bit of the
+		# distances, which float ** 2 doesn't always round like the arrays do
+		for i in np.flatnonzero(nonzero & (np.abs(np.abs(cos_curv) - 1) < 1e-9)):
+			curvatures[i + 1] = FeatureExtractor.curvature(float(x_a[i]), float(y_a[i]),
+			                                               float(x_b[i]), float(y_b[i]),
+			                                               float(x_c[i]), float(y_c[i]))
+		return curvatures
+
+	@staticmethod
+	def sliding_windows(a, width):
+		"""
+		Return a read-only view of the windows of width consecutive values of a.
+
+		The last windows are padded with the last value of a.
+
+		@type a: 1d np.array
+		@rtype: (len(a), width) np.array
+		"""
+		padded = np.concatenate((a, np.repeat(a[-1:], width - 1)))
+		windows = np.lib.stride_tricks.as_strided(padded, shape=(len(a), width),
+		                                          strides=(padded.strides[0], padded.strides[0]))
+		windows.flags.writeable = False
+		return windows
+
+	def vecinity_windows(self, lengths):
+		"""
+		Return the points of the vecinity of every point, as kept by the deque of L{extract}.
+
+		The vecinity starts with the first vecinity_reach + 1 points and
+		slides by one point at a time, adding the point at vecinity_reach
+		a second time and never adding the last point.
+
+		@type lengths: list of ints
+		@param lengths: number of points of each of the concatenated sequences
+		@rtype: (indices, lo, hi)
+		@return: indices of the points in the sequence of vecinity points,
+		         the vecinity of point i are the points indices[lo[i]:hi[i] + 1]
+		"""
+		reach = self.vecinity_reach
+		indices, lo, hi = [], [], []
+		start = 0
+		for n_points in lengths:
+			# a sequence has as many vecinity points as points
+			indices.append(np.arange(min(reach + 1, n_points)) + start)
+			indices.append(np.arange(reach, n_points - 1) + start)
+			seq_hi = np.minimum(reach + np.arange(n_points), n_points - 1)
+			lo.append(np.maximum(seq_hi - 2 * reach, 0) + start)
+			hi.append(seq_hi + start)
+			start += n_points
+		return (np.concatenate(indices).astype(np.intp), np.concatenate(lo).astype(np.intp),
+		        np.concatenate(hi).astype(np.intp))
+
+	def vecinity_features_array(self, x, y, integer, lengths=None):
+		"""
+		Vectorized L{vecinity_features} of every point.
+
+		@type x, y: np.array of floats
+		@type integer: np.array of bools
+		@param integer: points with int coordinates, the aspect between them
+		                is rounded down like the int division of vecinity_features
+		@param lengths: lengths of the concatenated sequences, None for one sequence
+		@rtype: (len(x), 5) np.array
+		"""
+		if lengths is None:
+			lengths = [len(x)]
+		indices, lo, hi = self.vecinity_windows(lengths)
+		x, y, integer = x[indices], y[indices], integer[indices]
+		width = 2 * self.vecinity_reach + 1
+		sizes = hi - lo  # number of segments of each vecinity
+
+		x1, y1, x2, y2 = x[lo], y[lo], x[hi], y[hi]
+		dx = np.abs(x2 - x1)
+		dy = np.abs(y2 - y1)
+		line_len = np.sqrt(dx ** 2 + dy ** 2)
+
+		# every point but the last one of each vecinity
+		xs = FeatureExtractor.sliding_windows(x, width - 1)[lo]
+		ys = FeatureExtractor.sliding_windows(y, width - 1)[lo]
+		in_window = np.arange(width - 1) < sizes[:, np.newaxis]
+
+		# trajectory lengths from the cumulative length of the segments,
+		# restarted at each sequence so that its rounding errors don't
+		# depend on the sequences before it
+		segments = np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2)
+		cumulative_len = np.zeros(len(x))
+		start = 0
+		for n_points in lengths:
+			np.cumsum(segments[start:start + n_points - 1], out=cumulative_len[start + 1:start + n_points])
+			start += n_points
+		trajectory_len = cumulative_len[hi] - cumulative_len[lo]
+
+		features = np.zeros((len(lo), 5))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			aspect = (dx - dy) / (dy + dx)
+			aspect[integer[lo] & integer[hi]] = np.floor(aspect[integer[lo] & integer[hi]])
+			features[:, 0] = np.where(dy + dx != 0, aspect, 0)
+			features[:, 1] = np.where(line_len != 0, dx / line_len, 0)
+			features[:, 2] = np.where(line_len != 0, dy / line_len, 0)
+
+			max_d = np.maximum(dx, dy)
+			features[:, 3] = np.where(max_d != 0, trajectory_len / max_d, 0)
+
+			# distance to the line from the first to the last point
+			distances = np.abs((x2 - x1)[:, np.newaxis] * (y1[:, np.newaxis] - ys) -
+			                   (x1[:, np.newaxis] - xs) * (y2 - y1)[:, np.newaxis]) / line_len[:, np.newaxis]
+			distances[line_len == 0] = 0
+			distances *= in_window
+			features[:, 4] = distances.sum(axis=1) / (sizes + 1)
+		return features
+
+	def normalize(self, writing):
+		"""
+		Return the resampled points of a normalized copy of the writing.
+
+		@type writing: tegaki.character.Writing
+		@rtype: list of annotated points (pen_down, x, y),
+		        see L{connect_stroke_endpoints}
+		"""
+		# same as crop_to_mbr, fit_to_box(300, 300), normalize_position
+		# and smooth of a copy of the writing
+		strokes = FeatureExtractor.normalize_arrays(writing, 300)
+
+		#resample and connect stroke endpoints
+		return self.connect_stroke_endpoints(self.resample_arrays(strokes))
+
+	def extract_array(self, writing):
+		"""
+		Extract the feature vector sequence with array operations.
+
+		Same features as L{extract}, up to rounding errors.
+		Will not modify writing, but instead use a copy.
+
+		@type writing: tegaki.character.Writing
+		@rtype: (T, number of active features) np.array of float32
+		"""
+		inputs, lengths, errors = self.extract_batch([writing])
+		if errors[0] is not None:
+			raise errors[0]
+		return inputs
+
+	def extract_batch(self, writings):
+		"""
+		Extract the feature vector sequences of several writings at once,
+		in the inputs and seqLengths layout of the RNNLIB nc files.
+
+		The features of all the points are computed together.
+		Will not modify the writings, but instead use copies.
+
+		@type writings: list of tegaki.character.Writing
+		@rtype: (inputs, lengths, errors)
+		@return: inputs is the (sum(lengths), number of active features)
+		         np.array of float32 of the concatenated sequences,
+		         lengths the np.array of the sequence lengths
+		         (0 for the writings that failed) and errors the exception
+		         raised by each writing or None
+		"""
+		sequences = []
+		errors = []
+		for writing in writings:
+			try:
+				if writing.empty():
+					raise ValueError("empty writing")
+				sequences.append(self.normalize(writing))
+				errors.append(None)
+			except Exception as e:
+				sequences.append([])
+				errors.append(e)
+
+		inputs, lengths = self.extract_annotated_points(sequences)
+		return inputs, lengths, errors
+
+	def extract_annotated_points(self, sequences):
+		"""
+		Compute the features of sequences of resampled points.
+
+		@type sequences: list of lists of annotated points (pen_down, x, y),
+		                 see L{normalize}
+		@rtype: (inputs, lengths), see L{extract_batch}
+		"""
+		lengths = np.array([len(annotated_points) for annotated_points in sequences], dtype=np.int32)
+		ends = np.cumsum(lengths)
+		ends = ends[lengths > 0]  # ends of the sequences which aren't empty
+		starts = ends - lengths[lengths > 0]
+
+		annotated_points = [point for points in sequences for point in points]
+		pen_down, x, y = np.array(annotated_points, dtype=np.float64).reshape(-1, 3).T
+		integer = np.array([isinstance(point_x, (int, long)) for _, point_x, _ in annotated_points], dtype=bool)
+
+		active = [i for i, feature_name in enumerate(self.feature_order)
+		          if self.active_features[feature_name]]
+		features = np.zeros((len(annotated_points), len(self.feature_order)))
+		features[:, 0] = pen_down
+		features[:, 1] = x
+		features[:, 2] = y
+		if len(annotated_points) > 0:
+			# the points next to the ends of the sequences belong to
+			# other sequences, their features are reset to the defaults
+			if 3 in active or 4 in active:
+				features[:, 3:5] = FeatureExtractor.writing_directions(x, y)
+				features[ends - 1, 3:5] = 1.0, 0.0
+			if 5 in active or 6 in active:
+				features[:, 5:7] = FeatureExtractor.curvatures(x, y)
+				features[starts, 5:7] = 1.0, 0.0
+				features[ends - 1, 5:7] = 1.0, 0.0
+			if max(active) >= 7:
+				# extract passes the annotated points to vecinity_features,
+				# which reads their first two values: pen_down and x
+				features[:, 7:12] = self.vecinity_features_array(pen_down, x, integer, lengths[lengths > 0])
+
+		return features[:, active].astype(np.float32, order='C'), lengths
+
 	def extract(self, writing):
 		"""
 		Extract feature vector sequence.
 		Will not modify writing, but instead use a copy.
 		@type character: tegaki.character.Writing
 		"""
-		writing = writing.copy()
-
-		#normalize
-		writing.crop_to_mbr()
-		writing.fit_to_box(300, 300)
-		writing.normalize_position()
-		writing.smooth()
-
-		#resample and connect stroke endpoints
-		strokes = writing.get_strokes(full=True)
-		annotated_points = self.connect_stroke_endpoints(self.resample_strokes(strokes))
+		annotated_points = self.normalize(writing)
 
 		feature_vector = []  # list of point-level features
 		x, y = None, None
@@ -314,7 +684,182 @@ class FeatureExtractor():
 		return filtered_features
 
 
+class IncrementalFeatureExtractor(object):
+	"""
+	Extracts the features of a writing while its strokes arrive.
+
+	Each stroke is normalized and resampled when it is added, in the frame
+	of the strokes added so far. The normalization depends on the bounding
+	box of the whole writing though: whenever a stroke grows it, all the
+	strokes added before are resampled again in the new frame. Early
+	strokes usually grow the box, so the work saved is mostly that of the
+	last strokes staying inside it, and the features are those of
+	L{FeatureExtractor.extract_array}. A stroke too small to be resampled
+	in the current frame is left to get_features, which also computes the
+	point features of the whole writing.
+
+	With rescale, the strokes are only resampled in the frame they are
+	added in, and get_features maps them to the final frame, with as many
+	points as the final frame gives their curve length. The sequences
+	mostly keep the length of extract_array, but the coordinates are off
+	by the rounding of the normalization, which the networks haven't been
+	trained with.
+
+	>>> incremental = IncrementalFeatureExtractor(feature_extractor)
+	>>> for stroke in writing.get_strokes(full=True):
+	...     incremental.add_stroke(stroke)
+	>>> features = incremental.get_features()
+	"""
+
+	#: Size of the box the writings are fit to, see L{FeatureExtractor.normalize}
+	BOX_SIZE = 300
+
+	def __init__(self, feature_extractor, rescale=False):
+		"""
+		@type feature_extractor: L{FeatureExtractor}
+		@param rescale: map the strokes to the final frame in get_features
+		                instead of resampling them again when the bounding
+		                box grows
+		"""
+		self.feature_extractor = feature_extractor
+		self.rescale = rescale
+		self.clear()
+
+	def clear(self):
+		"""
+		Forget the strokes added so far.
+		"""
+		self._strokes = []  # [([(x, y), ..], is_smoothed), ..] as added
+		# [(frame, xs, ys, curve length), ..] of each stroke, None until it
+		# is resampled, the curve length is None without a spline
+		self._resampled = []
+		self._bbox = None  # (xmin, ymin, xmax, ymax) of all the strokes
+		self._frame = None
+
+	def add_stroke(self, stroke):
+		"""
+		@type stroke: L{tegaki.character.Stroke}
+		@param stroke: the next stroke, ignored if empty
+		"""
+		points = [point.get_coordinates() for point in stroke]
+		if not points:
+			return
+
+		xs, ys = zip(*points)
+		bbox = min(xs), min(ys), max(xs), max(ys)
+		if self._bbox is not None:
+			bbox = (min(bbox[0], self._bbox[0]), min(bbox[1], self._bbox[1]),
+			        max(bbox[2], self._bbox[2]), max(bbox[3], self._bbox[3]))
+
+		self._strokes.append((points, stroke.get_is_smoothed()))
+		self._resampled.append(None)
+		self._bbox = bbox
+		self._frame = IncrementalFeatureExtractor.get_frame(bbox)
+		if self._frame is None:
+			# the writing can't be normalized yet
+			return
+
+		for i, resampled in enumerate(self._resampled):
+			if resampled is None or (resampled[0] != self._frame and not self.rescale):
+				try:
+					self._resampled[i] = self._resample(i)
+				except ValueError:
+					# no point at arc_len in this frame, the final one may have some
+					self._resampled[i] = None
+
+	@staticmethod
+	def get_frame(bbox):
+		"""
+		Return the normalization of a writing with the given bounding box,
+		as done by crop_to_mbr, fit_to_box and normalize_position.
+
+		@type bbox: (xmin, ymin, xmax, ymax)
+		@rtype: (xmin, ymin, rate, dx, dy) or None
+		@return: normalized coordinates are int((x - xmin) * rate) + dx,
+		         None if the writing is empty
+		"""
+		box_size = IncrementalFeatureExtractor.BOX_SIZE
+		xmin, ymin, xmax, ymax = bbox
+		width, height = xmax - xmin, ymax - ymin
+		if width == 0 or height == 0:
+			return None
+
+		hrate = box_size / float(height)
+		wrate = box_size / float(width)
+		rate = hrate if hrate * width < box_size else wrate
+		# the resized writing has int coordinates
+		dx = (box_size - int(width * rate)) / 2
+		dy = (box_size - int(height * rate)) / 2
+		return xmin, ymin, rate, dx, dy
+
+	def _resample(self, i):
+		"""
+		Return the resampled entry of stroke i in the current frame.
+		"""
+		points, is_smoothed = self._strokes[i]
+		xmin, ymin, rate, dx, dy = self._frame
+		points = np.array(points, dtype=float).reshape(-1, 2)
+		xs = np.trunc((points[:, 0] - xmin) * rate).astype(np.int64) + dx
+		ys = np.trunc((points[:, 1] - ymin) * rate).astype(np.int64) + dy
+		if not is_smoothed:
+			xs = FeatureExtractor.smooth_coordinates(xs)
+			ys = FeatureExtractor.smooth_coordinates(ys)
+		xs, ys = FeatureExtractor.remove_duplicate_points(xs, ys)
+		spline = len(xs) > 3
+		xs, ys, length = self.feature_extractor.resample_curve(xs, ys)
+		return self._frame, xs.tolist(), ys.tolist(), length if spline else None
+
+	def _rescale(self, i):
+		"""
+		Return the points of stroke i in the current frame.
+		"""
+		(xmin, ymin, rate, dx, dy), xs, ys, length = self._resampled[i]
+		new_xmin, new_ymin, new_rate, new_dx, new_dy = self._frame
+		scale = new_rate / rate
+		num = int(int(length * scale) / self.feature_extractor.arc_len) if length is not None else 0
+		if num < 2 or len(xs) < 2:
+			# a segment or two, or about arc_len long: as cheap to resample
+			# again, and resample_curve decides what is left of it
+			return self._resample(i)[1:3]
+
+		xs = (np.array(xs) - dx) * scale + (xmin - new_xmin) * new_rate + new_dx
+		ys = (np.array(ys) - dy) * scale + (ymin - new_ymin) * new_rate + new_dy
+
+		# the points are evenly spaced in the spline parameter or along
+		# the curve, as many as resample_curve gives the new curve length
+		if num != len(xs):
+			positions = np.linspace(0, 1, num)
+			xs = np.interp(positions, np.linspace(0, 1, len(xs)), xs)
+			ys = np.interp(positions, np.linspace(0, 1, len(ys)), ys)
+		return xs.tolist(), ys.tolist()
+
+	def get_features(self):
+		"""
+		Return the features of the strokes added so far, the same as
+		L{FeatureExtractor.extract_array} of a writing with these strokes
+		unless rescale is set.
+
+		@rtype: (T, number of active features) np.array of float32
+		"""
+		if self._frame is None:
+			raise ValueError("empty writing")
+
+		strokes = []
+		for i, resampled in enumerate(self._resampled):
+			if resampled is None:
+				# raises like extract_array if still too small
+				resampled = self._resample(i)
+			frame, xs, ys, _ = resampled
+			if frame != self._frame:
+				xs, ys = self._rescale(i)
+			strokes.append((xs, ys))
+		annotated_points = self.feature_extractor.connect_stroke_endpoints(strokes)
+		inputs, _ = self.feature_extractor.extract_annotated_points([annotated_points])
+		return inputs
+
 if __name__ == "__main__":
+	import matplotlib.pyplot as plt
+
 	extractor = FeatureExtractor(arc_len=20)
 
 	writing = Writing()
@@ -342,6 +887,32 @@ if __name__ == "__main__":
 
 	for f in feature_vector:
 		print f
+
+	# the incremental extraction has the features of extract_array, also
+	# when the first strokes are short or small and when a stroke is
+	# already smoothed
+	writings = [writing]
+	for first_stroke in ([(10, 10), (11, 12)], [(10, 10), (14, 18), (20, 15), (25, 24), (22, 30)]):
+		writing = Writing()
+		for points in (first_stroke, [(0, 0), (40, 90), (120, 60), (200, 160)],
+		               [(150, 20), (160, 40), (170, 30), (180, 60), (175, 80), (190, 90)]):
+			stroke = Stroke()
+			for x, y in points:
+				stroke.append_point(Point(x, y))
+			writing.append_stroke(stroke)
+		writings.append(writing)
+		writing = writing.copy()
+		writing.get_strokes(full=True)[-1].smooth()
+		writings.append(writing)
+	for writing in writings:
+		for rescale in (False, True):
+			incremental = IncrementalFeatureExtractor(extractor, rescale=rescale)
+			for stroke in writing.get_strokes(full=True):
+				incremental.add_stroke(stroke)
+			features = incremental.get_features()
+			if not rescale:
+				assert np.array_equal(features, extractor.extract_array(writing))
+	print "incremental features match"
 	plt.show()
 
 # pen_up = extractor.connect_stroke_endpoints(writing.get_strokes(full = True))
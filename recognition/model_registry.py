@@ -0,0 +1,163 @@
+import os
+import string
+
+from feature_extractor import FeatureExtractor
+from network import RnnlibNetwork
+
+
+class Model(object):
+	"""
+	A loaded network together with the feature extractor
+	its training datasets were built with.
+	"""
+
+	def __init__(self, writing_type, network, feature_extractor, path=None):
+		self.writing_type = writing_type
+		self.network = network
+		self.feature_extractor = feature_extractor
+		self.path = path
+
+	def get_labels(self):
+		return self.network.labels
+
+	def get_input_size(self):
+		return self.network.input_size
+
+	def __repr__(self):
+		return "<Model %s %d features %d labels (ref %d)>" % \
+		       (self.writing_type, self.get_input_size(), len(self.get_labels()), id(self))
+
+
+class ModelRegistry(object):
+	"""
+	Networks of a directory, parsed once and keyed by writing type.
+
+	>>> registry = ModelRegistry("saved_networks")
+	>>> model = registry.get_model("digit")
+	>>> model.network.classify(model.feature_extractor.extract(writing))
+	"""
+
+	#: Label sets of the known writing types
+	WRITING_TYPES = {"digit": list(string.digits),
+	                 "uppercase": list(string.ascii_uppercase),
+	                 "lowercase": list(string.ascii_lowercase)}
+
+	#: arc_len used when building the datasets of each writing type
+	ARC_LENS = {"digit": 30}
+	DEFAULT_ARC_LEN = 20
+
+	#: File extension of the networks to load
+	EXTENSION = ".save"
+	COMPILED_EXTENSION = RnnlibNetwork.COMPILED_EXTENSION
+
+	def __init__(self, networks_dir=None):
+		"""
+		@type networks_dir: str
+		@param networks_dir: directory to load the networks from or None
+		"""
+		self._models = {}
+
+		if networks_dir is not None:
+			self.load_directory(networks_dir)
+
+	@staticmethod
+	def get_writing_type(labels):
+		"""
+		Return the writing type recognized by a network with the given labels.
+
+		@type labels: list of str
+		@rtype: str or None
+		"""
+		for writing_type, type_labels in ModelRegistry.WRITING_TYPES.items():
+			if labels == type_labels:
+				return writing_type
+		return None
+
+	@staticmethod
+	def create_feature_extractor(writing_type, input_size):
+		"""
+		Return the feature extractor matching the network input.
+
+		@type input_size: int
+		@param input_size: 3, 7 or 12 features
+		@rtype: L{FeatureExtractor}
+		"""
+		feature_extractor = FeatureExtractor(arc_len=ModelRegistry.ARC_LENS.get(writing_type,
+		                                                                        ModelRegistry.DEFAULT_ARC_LEN))
+		if input_size == 3:
+			feature_extractor.set3f()
+		elif input_size == 7:
+			feature_extractor.set7f()
+		elif input_size != 12:
+			raise ValueError("No feature set with %d features" % input_size)
+		return feature_extractor
+
+	def load_directory(self, networks_dir):
+		"""
+		Load every network found in networks_dir.
+
+		A compiled network is preferred to its .save file unless it is older.
+
+		@type networks_dir: str
+		"""
+		paths = {}
+		for name in sorted(os.listdir(networks_dir)):
+			root, ext = os.path.splitext(name)
+			if ext in (self.EXTENSION, self.COMPILED_EXTENSION):
+				paths.setdefault(root, []).append(os.path.join(networks_dir, name))
+
+		for root in sorted(paths.keys()):
+			# the newest file wins, the compiled one when they have the same age
+			candidates = sorted(paths[root], key=lambda path: (os.path.getmtime(path),
+			                                                   path.endswith(self.COMPILED_EXTENSION)))
+			self.load_network(candidates[-1])
+
+	def load_network(self, path, writing_type=None):
+		"""
+		Load a network and register it.
+
+		@type path: str
+		@type writing_type: str
+		@param writing_type: the writing type to register the network for or None
+		                     to guess it from the network labels
+		@rtype: L{Model}
+		"""
+		network = RnnlibNetwork(path)
+		if writing_type is None:
+			writing_type = ModelRegistry.get_writing_type(network.labels)
+			if writing_type is None:
+				writing_type = os.path.splitext(os.path.basename(path))[0]
+
+		feature_extractor = ModelRegistry.create_feature_extractor(writing_type, network.input_size)
+		model = Model(writing_type, network, feature_extractor, path)
+		self.register(model)
+		return model
+
+	def register(self, model):
+		"""
+		Register model, replacing the model of the same writing type if any.
+
+		@type model: L{Model}
+		"""
+		self._models[model.writing_type] = model
+
+	def get_model(self, writing_type):
+		"""
+		@type writing_type: str
+		@rtype: L{Model}
+
+		Raises ValueError if no network recognizes writing_type.
+		"""
+		try:
+			return self._models[writing_type]
+		except KeyError:
+			raise ValueError("No network for writing type %s" % writing_type)
+
+	def get_writing_types(self):
+		"""
+		@rtype: list of str
+		"""
+		return sorted(self._models.keys())
+
+	def __repr__(self):
+		return "<ModelRegistry %s (ref %d)>" % (", ".join(self.get_writing_types()), id(self))
@@ -1,5 +1,6 @@
+import argparse
+import multiprocessing
 import string
-import traceback
 
 import numpy as np
 import netcdf_helpers
@@ -66,11 +67,14 @@ class NetCDFBuilder:
 
 		NetCDFBuilder.save_to_ncFile(ncFilename, self.labels, inputs, targetStrings, seqLengths, seqDims)
 
-	def _create_dataset(self, chars, ds_size, ncFilename):
+	def _create_dataset(self, chunks, ncFilename, pool=None, feature_cache=None):
 		"""
-		Extracts features from chars generator and builds the nc variables.
+		Extracts features from the chunks of chars and builds the nc variables.
 		Also saves to file those variables.
-		@param ds_size: the number of chars to use for this dataset
+		@param chunks: list of (db_file, charids, use_feature_cache) of the chars of this dataset
+		@param pool: multiprocessing.Pool to extract the chunks with or None
+		             to extract them in this process
+		@param feature_cache: CharacterCollection to store the extracted features in or None
 		"""
 		malformed_chars = 0
 		empty_chars = 0
@@ -78,71 +82,114 @@ class NetCDFBuilder:
 		inputs = []
 		targetStrings = []
 		seqLengths = []
-		seqDims = []
 
 		print 'Extracting features...'
-		try:
-			for i in range(ds_size):
-				if i != 0 and i % 500 == 0:
-					print 'at char', i
-				char = chars.next()
-
-				# ignore empty characters
-				char.remove_empty_strokes()
-				if char.empty():
-					empty_chars += 1
-					continue
-
-				# ignore malformed characters
-				try:
-					seq_inputs = self.feature_extractor.extract(char.get_writing())
-				except Exception:
-					traceback.print_exc()
-					malformed_chars += 1
-					continue
-
-				inputs += seq_inputs
-				seqLengths.append(len(seq_inputs))
-				seqDims.append([len(seq_inputs)])
-				targetStrings.append(char.get_utf8())
-		except StopIteration:
-			pass
+		if pool is None:
+			results = (_extract_chunk(chunk, self.feature_extractor) for chunk in chunks)
+		else:
+			# the results come back in the order of the chunks
+			results = pool.imap(_worker_extract_chunk, chunks)
+
+		n_chars = 0
+		for (_, charids, _), result in zip(chunks, results):
+			if n_chars != 0:
+				print 'at char', n_chars
+			n_chars += len(charids)
+
+			chunk_inputs, lengths, labels, chunk_empty, chunk_malformed, extracted_features = result
+			if feature_cache is not None and extracted_features:
+				feature_cache.set_cached_features(extracted_features, self.feature_extractor.get_fingerprint())
+				feature_cache.commit()
+			inputs.append(chunk_inputs)
+			seqLengths.extend(lengths.tolist())
+			targetStrings.extend(labels)
+			empty_chars += chunk_empty
+			malformed_chars += chunk_malformed
+
+		inputs = np.concatenate(inputs) if inputs else np.zeros((0, 0), dtype=np.float32)
+		seqDims = [[length] for length in seqLengths]
 
 		print "malformed chars:", malformed_chars
 		print "empty chars:", empty_chars
 		NetCDFBuilder.save_to_ncFile(ncFilename, self.labels, inputs, targetStrings, seqLengths, seqDims)
 
-	def create_datasets(self, db_name, dir_prefix, train_percent=0.6, validation_percent=0.2, test_percent=0.2):
+	def create_datasets(self, db_name, dir_prefix, train_percent=0.6, validation_percent=0.2, test_percent=0.2,
+	                    seed=None, processes=0, chunk_size=500, use_feature_cache=True, split_name=None):
 		"""
 		Splits into train, test and validation datasets and builds them.
 		From the given tegaki database name.
 		@precondition(train_percent + validation_percent + test_percent == 1.0)
+		@param seed: seed of the shuffling of the chars, the same seed
+		             builds the same datasets
+		@param processes: number of worker processes extracting the features,
+		                  None for one per cpu and 0 to extract them in this process
+		@param chunk_size: number of chars extracted together by a worker
+		@param use_feature_cache: reuse the features stored in the database by
+		                          previous runs with the same feature extractor
+		                          configuration, and store the new ones
+		@param split_name: name of a split stored in the database, see
+		                   L{CharacterCollection.create_split}, with train,
+		                   validation and test parts that have the same
+		                   proportion of each label. The split is created with
+		                   the given percents and seed if it doesn't exist yet.
+		                   If None, the shuffled chars are sliced by percent.
 		"""
 		db_file = "unipen_db/" + db_name + ".chardb"
 		charcol = CharacterCollection(db_file)
 
-		num_chars = charcol.get_total_n_characters()
-		print "total chars", num_chars
-		chars = charcol.get_random_characters_gen(num_chars)
+		if split_name is None:
+			charids = charcol.get_random_charids(seed=seed)
+			num_chars = len(charids)
+			print "total chars", num_chars
+
+			train_size = int(num_chars * train_percent)
+			validation_size = int(num_chars * validation_percent)
+			if (train_percent + validation_percent + test_percent) == 1.0:
+				# all the db is used
+				test_size = num_chars - train_size - validation_size
+			else:
+				# only a fraction of the db is used
+				test_size = int(num_chars * test_percent)
 
-		train_size = int(num_chars * train_percent)
-		validation_size = int(num_chars * validation_percent)
-		if (train_percent + validation_percent + test_percent) == 1.0:
-			# all the db is used
-			test_size = num_chars - train_size - validation_size
+			train_charids = charids[:train_size]
+			validation_charids = charids[train_size:train_size + validation_size]
+			test_charids = charids[train_size + validation_size:train_size + validation_size + test_size]
 		else:
-			# only a fraction of the db is used
-			test_size = int(num_chars * test_percent)
-
-		print 'train set size:', train_size
-		self._create_dataset(chars, train_size, dir_prefix + '_train_' + str(int(train_percent * 100)) + '.nc')
-		print 'validation set size:', validation_size
-		if validation_percent != 0.0:
-			self._create_dataset(chars, validation_size,
-			                     dir_prefix + '_validation_' + str(int(validation_percent * 100)) + '.nc')
-		print 'test set size:', test_size
-		if test_percent != 0.0:
-			self._create_dataset(chars, test_size, dir_prefix + '_test_' + str(int(test_percent * 100)) + '.nc')
+			if not charcol.has_split(split_name):
+				charcol.create_split(split_name, [("train", train_percent), ("validation", validation_percent),
+				                                  ("test", test_percent)], seed)
+				charcol.commit()
+			print "split", split_name
+			train_charids = charcol.get_split_charids(split_name, "train")
+			validation_charids = charcol.get_split_charids(split_name, "validation")
+			test_charids = charcol.get_split_charids(split_name, "test")
+
+		def chunks(charids):
+			return [(db_file, charids[i:i + chunk_size], use_feature_cache)
+			        for i in range(0, len(charids), chunk_size)]
+
+		# the workers only read the database, new features are stored by this process
+		feature_cache = charcol if use_feature_cache else None
+		pool = None
+		if processes != 0:
+			pool = multiprocessing.Pool(processes, _init_worker, (self.feature_extractor,))
+		try:
+			print 'train set size:', len(train_charids)
+			self._create_dataset(chunks(train_charids),
+			                     dir_prefix + '_train_' + str(int(train_percent * 100)) + '.nc', pool, feature_cache)
+			print 'validation set size:', len(validation_charids)
+			if validation_percent != 0.0:
+				self._create_dataset(chunks(validation_charids),
+				                     dir_prefix + '_validation_' + str(int(validation_percent * 100)) + '.nc',
+				                     pool, feature_cache)
+			print 'test set size:', len(test_charids)
+			if test_percent != 0.0:
+				self._create_dataset(chunks(test_charids),
+				                     dir_prefix + '_test_' + str(int(test_percent * 100)) + '.nc', pool, feature_cache)
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
 
 	@staticmethod
 	def convert_pybrain_dataset(ds, ncFilename):
@@ -180,12 +227,95 @@ class NetCDFBuilder:
 		NetCDFBuilder.save_to_ncFile(ncFilename, labels, inputs, targetStrings, seqLengths, seqDims)
 
 
+# collections and feature extractor of the current process, see NetCDFBuilder.create_datasets
+_charcols = {}
+_worker_feature_extractor = None
+
+
+def _extract_chunk(chunk, feature_extractor):
+	"""
+	Extract the features of a chunk of chars of a .chardb file.
+
+	@type chunk: (db_file, charids, use_feature_cache)
+	@rtype: (inputs, lengths, labels, empty_chars, malformed_chars, extracted_features)
+	@return: inputs and lengths of the chars which are neither empty
+	         nor malformed, see L{FeatureExtractor.extract_batch}, and
+	         the features which weren't cached, see
+	         L{CharacterCollection.set_cached_features}
+	"""
+	db_file, charids, use_feature_cache = chunk
+	charcol = _charcols.get(db_file)
+	if charcol is None:
+		charcol = _charcols[db_file] = CharacterCollection(db_file)
+		charcol.ARRAY_WRITINGS = True
+
+	sequences = {}  # {charid: (label, features)}
+	if use_feature_cache:
+		for charid, (label, n_features, data) in \
+				charcol.get_cached_features(charids, feature_extractor.get_fingerprint()).items():
+			sequences[charid] = label, np.frombuffer(data, dtype='<f4').astype(np.float32).reshape(-1, n_features)
+	missing_charids = [charid for charid in charids if charid not in sequences]
+
+	# ignore empty characters, the writings are copied so that
+	# removing their empty strokes isn't written back to the db
+	chars = []
+	writings = []
+	empty_chars = 0
+	for char in charcol.get_characters_by_ids(missing_charids):
+		writing = char.get_writing().copy()
+		writing.remove_empty_strokes()
+		if writing.empty():
+			empty_chars += 1
+			continue
+		chars.append(char)
+		writings.append(writing)
+
+	inputs, lengths, errors = feature_extractor.extract_batch(writings)
+	offsets = np.cumsum(lengths) - lengths
+
+	# ignore malformed characters
+	malformed_chars = 0
+	extracted_features = []
+	for char, offset, length, error in zip(chars, offsets, lengths, errors):
+		if error is not None:
+			print "malformed char:", repr(error)
+			malformed_chars += 1
+			continue
+		features = inputs[offset:offset + length]
+		sequences[char.charid] = char.get_utf8(), features
+		extracted_features.append((char.charid, features.shape[1], features.astype('<f4').tostring()))
+
+	sequences = [sequences[charid] for charid in charids if charid in sequences]
+	labels = [label for label, _ in sequences]
+	lengths = np.array([len(features) for _, features in sequences], dtype=np.int32)
+	if sequences:
+		inputs = np.concatenate([features for _, features in sequences])
+	return inputs, lengths, labels, empty_chars, malformed_chars, extracted_features
+
+
+def _init_worker(feature_extractor):
+	global _charcols, _worker_feature_extractor
+	# don't share the sqlite connections of the parent process
+	_charcols = {}
+	_worker_feature_extractor = feature_extractor
+
+
+def _worker_extract_chunk(chunk):
+	return _extract_chunk(chunk, _worker_feature_extractor)
+
+
 if __name__ == '__main__':
 	# train_ds = SequentialDataSet.loadFromFile("datasets/7best3f.ds")
 	# test_ds = SequentialDataSet.loadFromFile("datasets/3best3f.ds")
 	# NetCDFBuilder.convert_pybrain_dataset(train_ds, "datasets/7best3f.nc")
 	# NetCDFBuilder.convert_pybrain_dataset(test_ds, "datasets/3best3f.nc")
 
+	parser = argparse.ArgumentParser(description='Builds the RNNLIB nc datasets of a tegaki database.')
+	parser.add_argument('--stratified', action='store_true',
+	                    help="use the split stored as 'stratified' in the database, with the same proportion "
+	                         "of each label in the datasets, instead of slicing the shuffled characters")
+	args = parser.parse_args()
+
 	digits = map(None, string.digits)
 	up_letters = map(None, string.ascii_uppercase)
 	low_letters = map(None, string.ascii_lowercase)
@@ -193,4 +323,5 @@ if __name__ == '__main__':
 	# feature_extractor.set7f()
 	nc_builder = NetCDFBuilder(up_letters, feature_extractor)
 	nc_builder.create_datasets(db_name='1b/best_1b', dir_prefix='datasets/1b/12f', train_percent=0.6, validation_percent=0.2,
-	                           test_percent=0.2)
\ No newline at end of file
+	                           test_percent=0.2, processes=None,
+	                           split_name='stratified' if args.stratified else None)
\ No newline at end of file
@@ -0,0 +1,407 @@
+import os
+import struct
+import sys
+
+import numpy as np
+
+
+def logistic(x):
+	# tanh form doesn't overflow for the large unnormalized inputs
+	return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def softmax(x):
+	"""
+	Softmax over the last axis.
+	"""
+	e = np.exp(x - np.max(x, axis=-1)[..., np.newaxis])
+	return e / e.sum(axis=-1)[..., np.newaxis]
+
+
+class LstmLayer(object):
+	"""
+	A 1D RNNLIB lstm layer (one cell per block, peepholes, tanh cell
+	input/output squashing and logistic gates).
+
+	RNNLIB lays out the inputs of each block as
+	[input gate, forget gate, cell input, output gate]
+	and the peephole weights of each block as
+	[input gate, forget gate, output gate].
+	"""
+
+	def __init__(self, name, input_weights, bias_weights, recurrent_weights, peepholes, delay):
+		"""
+		@param input_weights: (inputSize, 4 * hiddenSize) array
+		@param bias_weights: (4 * hiddenSize,) array
+		@param recurrent_weights: (hiddenSize, 4 * hiddenSize) array
+		@param peepholes: (hiddenSize, 3) array
+		@param delay: -1 if the layer scans forward in time, 1 if backwards
+		"""
+		self.name = name
+		self.input_weights = input_weights
+		self.bias_weights = bias_weights
+		self.recurrent_weights = recurrent_weights
+		self.peepholes = peepholes
+		self.delay = delay
+		self.hidden_size = recurrent_weights.shape[0]
+
+	def feed_forward(self, inputs):
+		"""
+		Return the output activations of the layer.
+
+		@type inputs: (T, inputSize) np.array
+		@rtype: (T, hiddenSize) np.array
+		"""
+		mask = np.ones((len(inputs), 1), dtype=inputs.dtype)
+		return self.feed_forward_batch(inputs[:, np.newaxis, :], mask)[:, 0, :]
+
+	def feed_forward_batch(self, inputs, mask):
+		"""
+		Return the output activations of the layer for a batch of
+		padded sequences.
+
+		State and output are reset at padded timesteps, so a sequence is
+		never affected by the padding of the other ones (the backward
+		layer starts from a zero state at the last timestep of each sequence).
+
+		@type inputs: (T, N, inputSize) np.array
+		@type mask: (T, N) np.array, 1 for timesteps inside a sequence, 0 for padding
+		@rtype: (T, N, hiddenSize) np.array
+		"""
+		num_timesteps, num_seqs = inputs.shape[0], inputs.shape[1]
+		outputs = np.zeros((num_timesteps, num_seqs, self.hidden_size), dtype=inputs.dtype)
+
+		# the input and bias contributions don't depend on the previous state
+		block_inputs = np.dot(inputs.reshape(num_timesteps * num_seqs, -1), self.input_weights) + self.bias_weights
+		block_inputs = block_inputs.reshape(num_timesteps, num_seqs, self.hidden_size, 4)
+		mask = mask.reshape(num_timesteps, num_seqs, 1).astype(inputs.dtype)
+
+		in_peeps = self.peepholes[:, 0]
+		fg_peeps = self.peepholes[:, 1]
+		out_peeps = self.peepholes[:, 2]
+
+		if self.delay < 0:
+			timesteps = range(num_timesteps)
+		else:
+			timesteps = range(num_timesteps - 1, -1, -1)
+
+		state = np.zeros((num_seqs, self.hidden_size), dtype=inputs.dtype)
+		output = np.zeros((num_seqs, self.hidden_size), dtype=inputs.dtype)
+		for t in timesteps:
+			acts = block_inputs[t] + np.dot(output, self.recurrent_weights).reshape(num_seqs, self.hidden_size, 4)
+
+			in_gate = logistic(acts[:, :, 0] + in_peeps * state)
+			fg_gate = logistic(acts[:, :, 1] + fg_peeps * state)
+			state = (in_gate * np.tanh(acts[:, :, 2]) + fg_gate * state) * mask[t]
+			out_gate = logistic(acts[:, :, 3] + out_peeps * state)
+			output = out_gate * np.tanh(state) * mask[t]
+
+			outputs[t] = output
+
+		return outputs
+
+
+def pad_sequences(sequences, dtype=np.float64):
+	"""
+	Pad variable length sequences into one tensor.
+
+	@type sequences: list of (T_i, F) arrays or lists of feature vectors
+	@type dtype: np.dtype of the returned inputs
+	@rtype: (inputs, mask)
+	@return: inputs is a (max T_i, N, F) np.array padded with zeros,
+	         mask is a (max T_i, N) np.array with 1 where inputs are valid
+	"""
+	sequences = [np.asarray(seq, dtype=dtype) for seq in sequences]
+	lengths = [len(seq) for seq in sequences]
+	num_features = sequences[0].shape[1]
+
+	inputs = np.zeros((max(lengths), len(sequences), num_features), dtype=dtype)
+	mask = np.zeros((max(lengths), len(sequences)))
+	for i, seq in enumerate(sequences):
+		inputs[:lengths[i], i, :] = seq
+		mask[:lengths[i], i] = 1
+
+	return inputs, mask
+
+
+class RnnlibNetwork(object):
+	"""
+	In-process forward pass for the networks trained and saved by RNNLIB.
+
+	Only the topology used for character classification is supported:
+	a bidirectional lstm hidden level followed by a CollapseLayer and
+	a MulticlassClassificationLayer (softmax).
+
+	>>> net = RnnlibNetwork("saved_networks/net_1a_12-35_full.save")
+	>>> label = net.classify(feature_extractor.extract(writing))
+
+	Compiled networks
+	=================
+
+	Parsing the ascii floats of a .save file is slow. A network can be
+	compiled to a binary file holding only the config and the float32
+	weights (the optimiser state is dropped):
+
+	>>> RnnlibNetwork.compile("net_1a_12-35_full.save", "net_1a_12-35_full.rnnc")
+
+	Compiled networks are memory-mapped when loaded, so several processes
+	using the same file share one copy of the weights.
+
+	>>> net = RnnlibNetwork("saved_networks/net_1a_12-35_full.rnnc")
+
+	File layout: magic, version and header length (little-endian uint32),
+	the header text ("key value" config lines followed by
+	"connection name offset count" lines), then the weights as contiguous
+	little-endian float32 blocks starting at a 16 bytes aligned offset.
+	"""
+
+	WEIGHTS_SUFFIX = "_weights"
+	WEIGHTS_PREFIX = "weightContainer_"
+
+	COMPILED_EXTENSION = ".rnnc"
+	COMPILED_MAGIC = "RNNC"
+	COMPILED_VERSION = 1
+	COMPILED_ALIGNMENT = 16
+
+	def __init__(self, path=None):
+		"""
+		@type path: str
+		@param path: RNNLIB .save file to load or None
+		"""
+		self.config = {}
+		self.weights = {}
+		self.hidden_layers = []
+
+		if path is not None:
+			self.load(path)
+
+	@staticmethod
+	def parse_save_file(path):
+		"""
+		Parse a RNNLIB .save file.
+
+		Optimiser state (deltas, previous derivatives) is skipped.
+
+		@rtype: (config, weights)
+		@return: config is a dict of str values,
+		         weights is a dict of np.array indexed by connection name
+		"""
+		config = {}
+		weights = {}
+
+		f = open(path)
+		for line in f:
+			key, _, value = line.strip().partition(" ")
+			if not key.startswith(RnnlibNetwork.WEIGHTS_PREFIX):
+				config[key] = value
+			elif key.endswith(RnnlibNetwork.WEIGHTS_SUFFIX):
+				name = key[len(RnnlibNetwork.WEIGHTS_PREFIX):-len(RnnlibNetwork.WEIGHTS_SUFFIX)]
+				count, _, values = value.partition(" ")
+				weights[name] = np.fromstring(values, dtype=np.float64, sep=" ")
+				if len(weights[name]) != int(count):
+					raise ValueError("Connection %s has %d weights, expected %s" %
+					                 (name, len(weights[name]), count))
+		f.close()
+
+		return config, weights
+
+	@staticmethod
+	def parse_compiled_file(path):
+		"""
+		Parse a compiled network file. See L{compile}.
+
+		@rtype: (config, weights)
+		@return: config is a dict of str values,
+		         weights is a dict of read-only float32 arrays mapped on the file
+		         indexed by connection name
+		"""
+		f = open(path, "rb")
+		magic = f.read(len(RnnlibNetwork.COMPILED_MAGIC))
+		if magic != RnnlibNetwork.COMPILED_MAGIC:
+			f.close()
+			raise ValueError("%s is not a compiled network" % path)
+		version, header_len = struct.unpack("<II", f.read(8))
+		if version != RnnlibNetwork.COMPILED_VERSION:
+			f.close()
+			raise ValueError("Unsupported compiled network version %d" % version)
+		header = f.read(header_len)
+		f.close()
+
+		data_offset = RnnlibNetwork._compiled_data_offset(header_len)
+		data = np.memmap(path, dtype="<f4", mode="r", offset=data_offset)
+
+		config = {}
+		weights = {}
+		for line in header.splitlines():
+			key, _, value = line.partition(" ")
+			if key == "connection":
+				name, offset, count = value.split(" ")
+				offset, count = int(offset), int(count)
+				weights[name] = np.asarray(data[offset:offset + count])
+			else:
+				config[key] = value
+
+		return config, weights
+
+	@staticmethod
+	def _compiled_data_offset(header_len):
+		offset = len(RnnlibNetwork.COMPILED_MAGIC) + 8 + header_len
+		alignment = RnnlibNetwork.COMPILED_ALIGNMENT
+		return (offset + alignment - 1) // alignment * alignment
+
+	@staticmethod
+	def compile(save_path, compiled_path):
+		"""
+		Convert a RNNLIB .save file to a compiled network file.
+
+		@type save_path: str
+		@type compiled_path: str
+		"""
+		config, weights = RnnlibNetwork.parse_save_file(save_path)
+
+		lines = ["%s %s" % (key, config[key]) for key in sorted(config.keys())]
+		blocks = []
+		offset = 0
+		for name in sorted(weights.keys()):
+			lines.append("connection %s %d %d" % (name, offset, len(weights[name])))
+			blocks.append(weights[name].astype("<f4"))
+			offset += len(weights[name])
+		header = "\n".join(lines)
+
+		data_offset = RnnlibNetwork._compiled_data_offset(len(header))
+		f = open(compiled_path, "wb")
+		f.write(RnnlibNetwork.COMPILED_MAGIC)
+		f.write(struct.pack("<II", RnnlibNetwork.COMPILED_VERSION, len(header)))
+		f.write(header)
+		f.write("\0" * (data_offset - f.tell()))
+		for block in blocks:
+			f.write(block.tostring())
+		f.close()
+
+	def load(self, path):
+		"""
+		Load network from a RNNLIB .save file or a compiled network file.
+
+		@type path: str
+		"""
+		if path.endswith(RnnlibNetwork.COMPILED_EXTENSION):
+			self.config, self.weights = RnnlibNetwork.parse_compiled_file(path)
+		else:
+			self.config, self.weights = RnnlibNetwork.parse_save_file(path)
+		self._build()
+
+	def _build(self):
+		"""
+		Build the layers from config and weights.
+		"""
+		self.input_size = int(self.config["inputSize"])
+		self.hidden_size = int(self.config["hiddenSize"])
+		self.labels = self.config["targetLabels"].split(self.config.get("labelDelimiter", ","))
+		num_labels = len(self.labels)
+
+		self.hidden_layers = []
+		self.collapse_weights = []
+		for name in sorted(self.weights.keys()):
+			if not name.startswith("bias_to_hidden_"):
+				continue
+			layer_name = name[len("bias_to_"):]
+
+			recurrent_name = None
+			for other_name in self.weights.keys():
+				if other_name.startswith(layer_name + "_to_" + layer_name + "_delay_"):
+					recurrent_name = other_name
+			if recurrent_name is None:
+				raise ValueError("Layer %s has no recurrent connection" % layer_name)
+			delay = int(recurrent_name.split("_delay_")[1])
+
+			h = self.hidden_size
+			layer = LstmLayer(layer_name,
+			                  self._connection_weights("input_to_" + layer_name, self.input_size, 4 * h),
+			                  self.weights[name],
+			                  self._connection_weights(recurrent_name, h, 4 * h),
+			                  self.weights[layer_name + "_peepholes"].reshape(h, 3),
+			                  delay)
+			self.hidden_layers.append(layer)
+			self.collapse_weights.append(
+				self._connection_weights(layer_name + "_to_output_collapse", h, num_labels))
+
+		self.output_bias = self.weights["bias_to_output"]
+		self.dtype = self.output_bias.dtype
+
+	def _connection_weights(self, name, from_size, to_size):
+		"""
+		Return the weights of a full connection as a (from_size, to_size) matrix.
+
+		RNNLIB stores the weights going into the same unit contiguously.
+		"""
+		return self.weights[name].reshape(to_size, from_size).T
+
+	def forward(self, inputs):
+		"""
+		Compute the output activations for one sequence.
+
+		@type inputs: list of feature vectors or (T, inputSize) np.array
+		@rtype: np.array of len(labels) probabilities
+		"""
+		return self.forward_batch([inputs])[0]
+
+	def forward_batch(self, sequences):
+		"""
+		Compute the output activations for several sequences at once.
+
+		The sequences are padded to the longest one and run through
+		each hidden layer in a single pass.
+
+		@type sequences: list of (T_i, inputSize) arrays or lists of feature vectors
+		@rtype: (len(sequences), len(labels)) np.array of probabilities
+		"""
+		inputs, mask = pad_sequences(sequences, self.dtype)
+		if inputs.shape[2] != self.input_size:
+			raise ValueError("Network expects sequences of %d features, got %d" %
+			                 (self.input_size, inputs.shape[2]))
+
+		# the collapse layer sums its inputs over the whole sequence,
+		# padded timesteps have zero outputs and don't contribute
+		collapsed = np.tile(self.output_bias, (len(sequences), 1))
+		for layer, weights in zip(self.hidden_layers, self.collapse_weights):
+			outputs = layer.feed_forward_batch(inputs, mask)
+			collapsed += np.dot(outputs.sum(axis=0), weights)
+
+		return softmax(collapsed)
+
+	def classify(self, inputs):
+		"""
+		Return the label with the greatest output activation.
+
+		@rtype: str
+		"""
+		return self.labels[int(np.argmax(self.forward(inputs)))]
+
+	def classify_batch(self, sequences):
+		"""
+		Return the label with the greatest output activation for each sequence.
+
+		@rtype: list of str
+		"""
+		return [self.labels[i] for i in np.argmax(self.forward_batch(sequences), axis=1)]
+
+	def rank_batch(self, sequences):
+		"""
+		Return the labels of each sequence with their probabilities,
+		most probable first.
+
+		@rtype: list of lists of (label, probability)
+		"""
+		rankings = []
+		for probabilities in self.forward_batch(sequences):
+			order = np.argsort(-probabilities, kind="mergesort")
+			rankings.append([(self.labels[i], float(probabilities[i])) for i in order])
+		return rankings
+
+
+if __name__ == "__main__":
+	# compile the given .save files next to them
+	for save_path in sys.argv[1:]:
+		compiled_path = os.path.splitext(save_path)[0] + RnnlibNetwork.COMPILED_EXTENSION
+		print "compiling", save_path, "to", compiled_path
+		RnnlibNetwork.compile(save_path, compiled_path)
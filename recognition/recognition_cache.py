@@ -0,0 +1,108 @@
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from feature_extractor import FeatureExtractor
+
+
+def writing_digest(writing):
+	"""
+	Return a digest of the normalized writing.
+
+	Writings which only differ by their position or scale, or by less than
+	the rounding of the normalization, have the same digest.
+
+	@type writing: L{tegaki.character.Writing} or L{tegaki.character.ArrayWriting}
+	@rtype: str or None
+	@return: sha1 hex digest or None if the writing can't be normalized
+	"""
+	try:
+		# same normalization as FeatureExtractor.extract
+		strokes = FeatureExtractor.normalize_arrays(writing)
+	except (ValueError, ZeroDivisionError):
+		# empty writing, or a single point which can't be scaled
+		return None
+
+	sha1 = hashlib.sha1()
+	for xs, ys in strokes:
+		if len(xs):
+			sha1.update(struct.pack("<I", len(xs)))
+			sha1.update(np.column_stack((xs, ys)).astype("<i4").tostring())
+	return sha1.hexdigest()
+
+
+class RecognitionCache(object):
+	"""
+	LRU cache of recognition results with a time to live,
+	keyed by model and normalized writing digest.
+	"""
+
+	def __init__(self, max_size=10000, ttl=300):
+		"""
+		@param max_size: maximum number of results kept
+		@param ttl: seconds a result stays valid, None to never expire
+		"""
+		self.max_size = max_size
+		self.ttl = ttl
+		self._entries = OrderedDict()  # {key: (expiration time, result)}, oldest first
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def get_key(writing, model_id):
+		"""
+		@type model_id: str
+		@param model_id: identifies the model recognizing the writing,
+		                 e.g. its writing type
+		@rtype: tuple or None
+		@return: the cache key or None if the writing can't be cached
+		"""
+		digest = writing_digest(writing)
+		if digest is None:
+			return None
+		return model_id, digest
+
+	def get(self, key):
+		"""
+		@return: the cached result or None
+		"""
+		try:
+			expiration, result = self._entries.pop(key)
+		except KeyError:
+			self.misses += 1
+			return None
+
+		if expiration is not None and expiration < time.time():
+			self.misses += 1
+			return None
+
+		# most recently used entries go last
+		self._entries[key] = expiration, result
+		self.hits += 1
+		return result
+
+	def set(self, key, result):
+		if key in self._entries:
+			del self._entries[key]
+		expiration = None if self.ttl is None else time.time() + self.ttl
+		self._entries[key] = expiration, result
+
+		while len(self._entries) > self.max_size:
+			self._entries.popitem(last=False)
+
+	def clear(self):
+		self._entries.clear()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def get_metrics(self):
+		"""
+		@rtype: dict
+		"""
+		return {'cache_hits': self.hits,
+		        'cache_misses': self.misses,
+		        'cache_size': len(self._entries)}
@@ -0,0 +1,160 @@
+import multiprocessing
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+
+class Recognizer(object):
+	"""
+	Recognizes writings with the networks of a L{ModelRegistry}.
+	"""
+
+	def __init__(self, model_registry):
+		"""
+		@type model_registry: L{ModelRegistry}
+		"""
+		self.model_registry = model_registry
+
+	def recognize(self, writing, writing_type):
+		"""
+		Return the label of the writing.
+
+		@type writing: L{tegaki.character.Writing}
+		@type writing_type: str
+		@rtype: str
+
+		Raises ValueError for empty writings and unknown writing types.
+		"""
+		return self.rank(writing, writing_type)[0][0]
+
+	def rank(self, writing, writing_type):
+		"""
+		Return the labels of the writing with their probabilities.
+
+		@rtype: list of (label, probability), most probable first
+
+		Raises ValueError for empty writings and unknown writing types.
+		"""
+		ranking = self.recognize_batch([(writing, writing_type)])[0]
+		if isinstance(ranking, Exception):
+			raise ranking
+		return ranking
+
+	def recognize_batch(self, requests):
+		"""
+		Recognize several writings with one network pass per writing type.
+
+		@type requests: list of (writing, writing_type)
+		@rtype: list
+		@return: the ranking of each writing, see L{rank}, or the exception
+		         that prevented its recognition
+		"""
+		results = [None] * len(requests)
+		batches = {}  # {writing_type: ([request index, ..], [writing, ..])}
+
+		for i, (writing, writing_type) in enumerate(requests):
+			try:
+				self.model_registry.get_model(writing_type)
+
+				# ignore empty characters
+				writing.remove_empty_strokes()
+				if writing.empty():
+					raise ValueError("empty writing")
+			except Exception as e:
+				results[i] = e
+				continue
+
+			indices, writings = batches.setdefault(writing_type, ([], []))
+			indices.append(i)
+			writings.append(writing)
+
+		for writing_type, (indices, writings) in batches.items():
+			model = self.model_registry.get_model(writing_type)
+			inputs, lengths, errors = model.feature_extractor.extract_batch(writings)
+			sequences = np.split(inputs, np.cumsum(lengths)[:-1])
+
+			extracted = []
+			for i, sequence, error in zip(indices, sequences, errors):
+				if error is None:
+					extracted.append((i, sequence))
+				else:
+					results[i] = error
+			if not extracted:
+				continue
+
+			rankings = model.network.rank_batch([sequence for _, sequence in extracted])
+			for (i, _), ranking in zip(extracted, rankings):
+				results[i] = ranking
+
+		return results
+
+
+# recognizer of the current worker process, see RecognitionPool
+_worker_recognizer = None
+
+
+def _init_worker(networks_dir):
+	global _worker_recognizer
+	_worker_recognizer = Recognizer(ModelRegistry(networks_dir))
+
+
+def _worker_recognize(writing, writing_type):
+	return _worker_recognizer.recognize(writing, writing_type)
+
+
+def _worker_recognize_batch(requests):
+	return _worker_recognizer.recognize_batch(requests)
+
+
+class RecognitionPool(object):
+	"""
+	Runs feature extraction and inference in a pool of worker processes.
+
+	Each worker loads the networks once when it starts. Compiled networks
+	are memory-mapped, so the workers share one copy of the weights.
+
+	recognize() blocks until a worker is done. Event loops should call it
+	from a thread, for example with twisted.internet.threads.deferToThread.
+	"""
+
+	def __init__(self, networks_dir, processes=None):
+		"""
+		@type networks_dir: str
+		@param networks_dir: directory of the networks, see L{ModelRegistry}
+		@type processes: int
+		@param processes: number of worker processes, None for one per cpu
+		                  and 0 to recognize in the calling process
+		"""
+		self.processes = processes
+		if processes == 0:
+			self._pool = None
+			self._recognizer = Recognizer(ModelRegistry(networks_dir))
+		else:
+			self._pool = multiprocessing.Pool(processes, _init_worker, (networks_dir,))
+			self._recognizer = None
+
+	def recognize(self, writing, writing_type):
+		"""
+		See L{Recognizer.recognize}.
+		"""
+		if self._pool is None:
+			return self._recognizer.recognize(writing, writing_type)
+		return self._pool.apply(_worker_recognize, (writing, writing_type))
+
+	def recognize_batch(self, requests):
+		"""
+		See L{Recognizer.recognize_batch}. The whole batch goes to one worker.
+		"""
+		if self._pool is None:
+			return self._recognizer.recognize_batch(requests)
+		return self._pool.apply(_worker_recognize_batch, (requests,))
+
+	def close(self):
+		"""
+		Stop the worker processes.
+		"""
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool.join()
+			self._pool = None
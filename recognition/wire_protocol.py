@@ -0,0 +1,122 @@
+"""
+Binary framing of writings for the recognition server.
+
+A frame is a header followed by a payload:
+
+	header:  magic "TW", version (uint8), payload length (uint32)
+	payload: request id (uint32) and number of labels to reply with their
+	         scores (uint8, 0 for the label only), in version 2 frames only,
+	         writing type length (uint8), writing type (ascii),
+	         coordinate format (uint8, 0 for int16 and 1 for float32),
+	         number of strokes (uint16), number of points of each stroke (uint16 each),
+	         x, y of every point of every stroke in the coordinate format
+
+All numbers are in network byte order. Coordinates use the same axes as the
+XML protocol (y pointing down), see L{tegaki.character.Writing.from_xml}.
+
+Replies to version 1 frames are sent in the order of the requests, replies
+to version 2 frames as soon as they are ready, starting with the request id.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = "TW"
+VERSION = 2
+VERSIONS = (1, 2)
+
+HEADER = struct.Struct("!2sBI")
+REQUEST = struct.Struct("!IB")
+
+INT16 = 0
+FLOAT32 = 1
+COORDINATE_DTYPES = {INT16: np.dtype(">i2"), FLOAT32: np.dtype(">f4")}
+
+
+def read_frame(data):
+	"""
+	Split the first frame from data.
+
+	@type data: str
+	@rtype: (version, payload, rest)
+	@return: version and payload are None if data doesn't hold a complete frame yet
+
+	Raises ValueError if data doesn't start with a frame header.
+	"""
+	if len(data) < HEADER.size:
+		if not MAGIC.startswith(data[:len(MAGIC)]):
+			raise ValueError("Not a writing frame")
+		return None, None, data
+
+	magic, version, length = HEADER.unpack_from(data)
+	if magic != MAGIC:
+		raise ValueError("Not a writing frame")
+	if version not in VERSIONS:
+		raise ValueError("Unsupported frame version %d" % version)
+
+	end = HEADER.size + length
+	if len(data) < end:
+		return None, None, data
+	return version, data[HEADER.size:end], data[end:]
+
+
+def decode_strokes(payload, version=VERSION):
+	"""
+	Decode a frame payload into coordinate arrays.
+
+	@type payload: str
+	@rtype: (writing_type, strokes, request_id, top_k)
+	@return: strokes is a list of (xs, ys) np.arrays,
+	         request_id is None and top_k 0 for version 1 frames
+
+	Raises ValueError for malformed payloads.
+	"""
+	try:
+		request_id, top_k, offset = None, 0, 0
+		if version >= 2:
+			request_id, top_k = REQUEST.unpack_from(payload)
+			offset = REQUEST.size
+		type_len = ord(payload[offset])
+		writing_type = payload[offset + 1:offset + 1 + type_len]
+		offset += 1 + type_len
+		coordinate_format, n_strokes = struct.unpack_from("!BH", payload, offset)
+		offset += 3
+		n_points = np.frombuffer(payload, dtype=">u2", count=n_strokes, offset=offset)
+		offset += 2 * n_strokes
+		dtype = COORDINATE_DTYPES[coordinate_format]
+		coordinates = np.frombuffer(payload, dtype=dtype, count=2 * int(n_points.sum()), offset=offset)
+	except (IndexError, KeyError, struct.error, ValueError):
+		raise ValueError("Malformed writing frame")
+	if offset + coordinates.nbytes != len(payload):
+		raise ValueError("Malformed writing frame")
+
+	coordinates = coordinates.reshape(-1, 2)
+	strokes = []
+	start = 0
+	for n in n_points.tolist():
+		strokes.append((coordinates[start:start + n, 0], coordinates[start:start + n, 1]))
+		start += n
+	return writing_type, strokes, request_id, top_k
+
+
+def encode_writing(strokes, writing_type, coordinate_format=INT16, request_id=None, top_k=0):
+	"""
+	Encode a frame, e.g. for clients and tests.
+
+	@type strokes: list of lists of (x, y)
+	@param strokes: coordinates with y pointing down
+	@type request_id: int
+	@param request_id: id echoed in the reply or None for a version 1 frame
+	@rtype: str
+	"""
+	dtype = COORDINATE_DTYPES[coordinate_format]
+	payload = struct.pack("!B", len(writing_type)) + writing_type
+	payload += struct.pack("!BH", coordinate_format, len(strokes))
+	payload += np.array([len(stroke) for stroke in strokes], dtype=">u2").tostring()
+	for stroke in strokes:
+		payload += np.array(stroke, dtype=dtype).reshape(-1, 2).tostring()
+	if request_id is None:
+		return HEADER.pack(MAGIC, 1, len(payload)) + payload
+	payload = REQUEST.pack(request_id, top_k) + payload
+	return HEADER.pack(MAGIC, VERSION, len(payload)) + payload
@@ -29,6 +29,7 @@ try:
 except ImportError:
 	pass
 from math import floor, atan, sin, cos, pi
+from array import array
 import hashlib
 
 try:
@@ -42,14 +43,19 @@ except ImportError:
 from tegaki.mathutils import euclidean_distance
 
 
-class Point(dict):
+class Point(object):
 	"""
 	A point in a 2-dimensional space.
+
+	The attributes of a point are slots, so that points take little memory.
+	They can also be accessed like the keys of a dict, e.g. point["x"].
 	"""
 
 	#: Attributes that a point can have.
 	KEYS = ("x", "y", "pressure", "xtilt", "ytilt", "timestamp")
 
+	__slots__ = KEYS
+
 	def __init__(self, x=None, y=None,
 				 pressure=None, xtilt=None, ytilt=None,
 				 timestamp=None):
@@ -62,9 +68,6 @@ class Point(dict):
 		@type timestamp: int
 		@param timestamp: ellapsed time since first point in milliseconds
 		"""
-
-		dict.__init__(self)
-
 		self.x = x
 		self.y = y
 
@@ -74,17 +77,39 @@ class Point(dict):
 
 		self.timestamp = timestamp
 
-	def __getattr__(self, attr):
-		try:
-			return self[attr]
-		except KeyError:
-			raise AttributeError
+	def __getitem__(self, key):
+		if key not in self.KEYS:
+			raise KeyError(key)
+		return getattr(self, key)
 
-	def __setattr__(self, attr, value):
-		try:
-			self[attr] = value
-		except KeyError:
-			raise AttributeError
+	def __setitem__(self, key, value):
+		if key not in self.KEYS:
+			raise KeyError(key)
+		setattr(self, key, value)
+
+	def __contains__(self, key):
+		return key in self.KEYS
+
+	def __iter__(self):
+		return iter(self.KEYS)
+
+	def keys(self):
+		return list(self.KEYS)
+
+	def items(self):
+		return [(key, getattr(self, key)) for key in self.KEYS]
+
+	def get(self, key, default=None):
+		if key not in self.KEYS:
+			return default
+		return getattr(self, key)
+
+	def __getstate__(self):
+		return tuple(getattr(self, key) for key in self.KEYS)
+
+	def __setstate__(self, state):
+		for key, value in zip(self.KEYS, state):
+			setattr(self, key, value)
 
 	def get_coordinates(self):
 		"""
@@ -175,10 +200,8 @@ class Point(dict):
 		@type p: L{Point}
 		@param p: the point to copy from
 		"""
-		self.clear()
-		for k in p.keys():
-			if p[k] is not None:
-				self[k] = p[k]
+		for key in self.KEYS:
+			setattr(self, key, p[key])
 
 	def copy(self):
 		"""
@@ -186,7 +209,8 @@ class Point(dict):
 
 		@rtype: L{Point}
 		"""
-		return Point(**self)
+		return Point(self.x, self.y, self.pressure, self.xtilt, self.ytilt,
+		             self.timestamp)
 
 	def __repr__(self):
 		return "<Point (%s, %s) (ref %d)>" % (self.x, self.y, id(self))
@@ -305,10 +329,10 @@ class Stroke(list):
 		@type s: L{Stroke}
 		@param s: the stroke to copy from
 		"""
+		points = [p.copy() for p in s]
 		self.clear()
 		self._is_smoothed = s.get_is_smoothed()
-		for p in s:
-			self.append_point(p.copy())
+		self.extend(points)
 
 	def copy(self):
 		"""
@@ -377,8 +401,7 @@ class Stroke(list):
 		"""
 		Remove all points from stroke.
 		"""
-		while len(self) != 0:
-			del self[0]
+		del self[:]
 		self._is_smoothed = False
 
 	def downsample(self, n):
@@ -511,13 +534,22 @@ class Writing(object):
 
 	@staticmethod
 	def from_xml(xml_str):
+		writing, attributes = Writing.from_xml_with_attributes(xml_str)
+		return writing, attributes['type']
+
+	@staticmethod
+	def from_xml_with_attributes(xml_str):
+		"""
+		Like from_xml but also return all the attributes of the writing element.
+
+		@rtype: (L{Writing}, dict)
+		"""
 		root = ET.fromstring(xml_str)
 		if root.tag != 'writing':
 			raise xml.etree.ElementTree.ParseError('Root element is not writing')
 		if 'type' not in root.attrib:
 			raise xml.etree.ElementTree.ParseError('Writing has no type attribute')
 
-		writing_type = root.attrib['type']
 		writing = Writing()
 		for stroke_elem in root:
 			if stroke_elem.tag != 'stroke':
@@ -530,7 +562,7 @@ class Writing(object):
 				p = Point(float(x), -float(y))
 				stroke.append(p)
 			writing.append_stroke(stroke)
-		return writing, writing_type
+		return writing, dict(root.attrib)
 
 
 
@@ -988,7 +1020,7 @@ class Writing(object):
 				"".join([s.to_sexp() for s in self._strokes]))
 
 	def __eq__(self, othr):
-		if not othr.__class__.__name__ in ("Writing", "WritingProxy"):
+		if not othr.__class__.__name__ in ("Writing", "WritingProxy", "ArrayWriting"):
 			return False
 
 		if self.get_n_strokes() != othr.get_n_strokes():
@@ -1062,6 +1094,340 @@ class Writing(object):
 			else:
 				i += 1
 
+class ArrayWriting(object):
+	"""
+	A L{Writing} which keeps its points in contiguous arrays.
+
+	Each point attribute (see L{Point.KEYS}) of the whole writing is stored
+	in one array of doubles, with one byte per value telling whether it is
+	an int, and the strokes are delimited by an array of offsets, instead
+	of one L{Point} dict per point. x and y are always stored, the other
+	attributes only if some point has them.
+
+	The L{Strokes<Stroke>} and L{Points<Point>} returned by L{get_strokes}
+	are built on demand, changing them doesn't change the writing.
+
+	>>> writing = ArrayWriting.from_writing(char.get_writing())
+	>>> xs, ys, offsets = writing.get_coordinate_arrays()
+	"""
+
+	def __init__(self):
+		self._width = Writing.WIDTH
+		self._height = Writing.HEIGHT
+		self.clear()
+
+	@staticmethod
+	def from_writing(writing):
+		"""
+		Return a compact copy of writing.
+
+		@type writing: L{Writing}
+		@rtype: L{ArrayWriting}
+		"""
+		c = ArrayWriting()
+		c.copy_from(writing)
+		return c
+
+	@staticmethod
+	def from_columns(columns, n_points):
+		"""
+		Return a writing from the values of its points.
+
+		@type columns: dict
+		@param columns: {attribute: values of all the points}, x and y
+		                are required, None values aren't allowed
+		@type n_points: list of int
+		@param n_points: number of points of each stroke
+		@rtype: L{ArrayWriting}
+		"""
+		w = ArrayWriting()
+		for key, values in columns.items():
+			w._values[key] = array('d', values)
+			w._is_int[key] = array('b', [isinstance(value, (int, long)) for value in values])
+		for n in n_points:
+			w._offsets.append(w._offsets[-1] + n)
+		w._smoothed = [False] * len(n_points)
+		return w
+
+	def to_writing(self):
+		"""
+		Return a copy of writing made of L{Stroke} and L{Point} objects.
+
+		@rtype: L{Writing}
+		"""
+		w = Writing()
+		w.set_width(self._width)
+		w.set_height(self._height)
+		for stroke in self.get_strokes(full=True):
+			w.append_stroke(stroke)
+		return w
+
+	def clear(self):
+		"""
+		Remove all strokes from writing.
+		"""
+		self._offsets = array('l', [0])
+		self._values = {"x": array('d'), "y": array('d')}  # NaN for None
+		self._is_int = {"x": array('b'), "y": array('b')}
+		self._smoothed = []
+
+	def empty(self):
+		if self.get_n_strokes() == 0:
+			return 1
+		x, y, width, height = self.size()
+		return width == 0 or height == 0
+
+	def get_duration(self):
+		"""
+		Return the time that it took to draw the strokes.
+
+		@rtype: int or None
+		@return: time in millisecons or None if the information is not available
+		"""
+		if self.get_n_points() > 0:
+			start = self._get_value("timestamp", 0)
+			end = self._get_value("timestamp", self.get_n_points() - 1)
+			if start is not None and end is not None:
+				return end - start
+		return None
+
+	def get_n_strokes(self):
+		"""
+		Return the number of strokes.
+
+		@rtype: int
+		"""
+		return len(self._offsets) - 1
+
+	def get_n_points(self):
+		"""
+		Return the total number of points.
+		"""
+		return self._offsets[-1]
+
+	def get_coordinate_arrays(self):
+		"""
+		Return the arrays the coordinates are stored in, not copies.
+
+		@rtype: (xs, ys, offsets)
+		@return: x and y of all the points as arrays of doubles, the points
+		         of stroke i are in [offsets[i], offsets[i + 1])
+		"""
+		return self._values["x"], self._values["y"], self._offsets
+
+	def get_smoothed_strokes(self):
+		"""
+		Return whether each stroke has been smoothed already or not.
+
+		@rtype: list of boolean
+		"""
+		return list(self._smoothed)
+
+	def get_strokes(self, full=False):
+		"""
+		Return strokes.
+
+		@type full: boolean
+		@param full: whether to return strokes as objects or as (x,y) pairs
+		"""
+		xs, ys, offsets = self.get_coordinate_arrays()
+		if not full:
+			# For compatibility
+			return [[(int(x), int(y)) for x, y in zip(xs[start:end], ys[start:end])]
+			        for start, end in zip(offsets, offsets[1:])]
+
+		columns = [(key, self._get_column(key)) for key in self._values]
+		strokes = []
+		for start, end, smoothed in zip(offsets, offsets[1:], self._smoothed):
+			stroke = Stroke()
+			for i in range(start, end):
+				point = Point()
+				for key, column in columns:
+					point[key] = column[i]
+				stroke.append_point(point)
+			stroke._is_smoothed = smoothed
+			strokes.append(stroke)
+		return strokes
+
+	def append_stroke(self, stroke):
+		"""
+		Add a new stroke.
+
+		@type stroke: L{Stroke}
+		"""
+		n_points = self.get_n_points()
+		for key in Point.KEYS:
+			column = [point[key] for point in stroke]
+			if key not in self._values:
+				if all(value is None for value in column):
+					continue
+				self._values[key] = array('d', [float("nan")]) * n_points
+				self._is_int[key] = array('b', [0]) * n_points
+			self._values[key].extend([float("nan") if value is None else value
+			                          for value in column])
+			self._is_int[key].extend([isinstance(value, (int, long)) for value in column])
+		self._offsets.append(n_points + len(stroke))
+		self._smoothed.append(stroke.get_is_smoothed())
+
+	def remove_empty_strokes(self):
+		offsets = array('l', [0])
+		smoothed = []
+		for end, is_smoothed in zip(self._offsets[1:], self._smoothed):
+			if end != offsets[-1]:
+				offsets.append(end)
+				smoothed.append(is_smoothed)
+		self._offsets = offsets
+		self._smoothed = smoothed
+
+	def size(self):
+		"""
+		Return writing size.
+
+		@rtype: (x, y, width, height)
+		@return: (x,y) are the coordinates of the upper-left point
+		"""
+		if self.get_n_points() == 0:
+			# same as Writing.size
+			return (4294967296, 4294967296, -4294967295 - 4294967296, -4294967295 - 4294967296)
+
+		xs, ys, offsets = self.get_coordinate_arrays()
+		xmin = self._get_value("x", xs.index(min(xs)))
+		ymin = self._get_value("y", ys.index(min(ys)))
+		xmax = self._get_value("x", xs.index(max(xs)))
+		ymax = self._get_value("y", ys.index(max(ys)))
+		return (xmin, ymin, xmax - xmin, ymax - ymin)
+
+	def get_size(self):
+		"""
+		Return the size of the drawing box.
+
+		@rtype: tuple
+
+		Not to be confused with size() which returns the size the writing.
+		"""
+		return (self.get_width(), self.get_height())
+
+	def set_size(self, w, h):
+		self.set_width(w)
+		self.set_height(h)
+
+	def get_width(self):
+		"""
+		Return the width of the drawing box.
+
+		@rtype: int
+		"""
+		return self._width
+
+	def set_width(self, width):
+		"""
+		Set the drawing box width.
+		"""
+		self._width = width
+
+	def get_height(self):
+		"""
+		Return the height of the drawing box.
+
+		@rtype: int
+		"""
+		return self._height
+
+	def set_height(self, height):
+		"""
+		Set the drawing box height.
+		"""
+		self._height = height
+
+	def to_xml(self):
+		"""
+		Converts writing to XML.
+
+		@rtype: str
+		"""
+		return self.to_writing().to_xml()
+
+	def to_json(self):
+		"""
+		Converts writing to JSON.
+
+		@rtype: str
+		"""
+		return self.to_writing().to_json()
+
+	def to_sexp(self):
+		"""
+		Converts writing to S-expressions.
+
+		@rtype: str
+		"""
+		return self.to_writing().to_sexp()
+
+	def __eq__(self, othr):
+		if not othr.__class__.__name__ in ("Writing", "WritingProxy", "ArrayWriting"):
+			return False
+
+		if self.get_n_strokes() != othr.get_n_strokes():
+			return False
+
+		if self.get_width() != othr.get_width():
+			return False
+
+		if self.get_height() != othr.get_height():
+			return False
+
+		return self.get_strokes(full=True) == othr.get_strokes(full=True)
+
+	def __ne__(self, othr):
+		return not (self == othr)
+
+	def copy_from(self, w):
+		"""
+		Replace writing with another writing.
+
+		@type w: L{Writing} or L{ArrayWriting}
+		@param w: the writing to copy from
+		"""
+		self.clear()
+		self.set_width(w.get_width())
+		self.set_height(w.get_height())
+
+		if isinstance(w, ArrayWriting):
+			self._offsets = w._offsets[:]
+			self._values = dict((key, values[:]) for key, values in w._values.items())
+			self._is_int = dict((key, is_int[:]) for key, is_int in w._is_int.items())
+			self._smoothed = list(w._smoothed)
+		else:
+			for s in w.get_strokes(True):
+				self.append_stroke(s)
+
+	def copy(self):
+		"""
+		Return a copy writing.
+
+		@rtype: L{ArrayWriting}
+		"""
+		c = ArrayWriting()
+		c.copy_from(self)
+		return c
+
+	def __repr__(self):
+		return "<ArrayWriting %d strokes (ref %d)>" % (self.get_n_strokes(),
+		                                               id(self))
+
+	def _get_column(self, key):
+		# the values of an attribute of all the points
+		return [None if value != value else int(value) if is_int else value
+		        for value, is_int in zip(self._values[key], self._is_int[key])]
+
+	def _get_value(self, key, i):
+		if key not in self._values:
+			return None
+		value = self._values[key][i]
+		if value != value:
+			return None
+		return int(value) if self._is_int[key][i] else value
+
 class _IOBase(object):
 	"""
 	Class providing IO functionality to L{Character} and \
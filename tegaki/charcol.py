@@ -21,11 +21,17 @@
 
 import sqlite3
 import base64
+import contextlib
+import hashlib
+import random
+import struct
 import re
 import os
+import sys
+import time
 
 from tegaki.dictutils import SortedDict
-from tegaki.character import _XmlBase, Point, Stroke, Writing, Character
+from tegaki.character import _XmlBase, Point, Stroke, Writing, ArrayWriting, Character
 
 
 def _dict_factory(cursor, row):
@@ -197,16 +203,201 @@ WHERE charid=?""", (char.get_utf8(), char.get_writing().get_n_strokes(),
 		self.clear()
 
 
-def _convert_character(data):
+# Binary encoding of the characters (version 1), all numbers are varints:
+#
+#   magic "\0TC", version (byte), flags (bit 0: has utf8, bits 1-4: points
+#   have a pressure, xtilt, ytilt, timestamp), utf8 length and utf8,
+#   width, height (zigzag), number of strokes, number of points of each
+#   stroke, then for all the points of the writing: x deltas, y deltas,
+#   timestamp deltas (zigzag, the first delta is from 0) and pressure,
+#   xtilt and ytilt as little-endian doubles.
+#
+# Older collections store the base64 of the gzipped XML of the characters,
+# which can't start with the magic.
+BINARY_MAGIC = "\0TC"
+BINARY_VERSION = 1
+_FLOAT_CHANNELS = ("pressure", "xtilt", "ytilt")
+
+
+# same as writing the values to XML and reading them back
+
+def _to_int(value):
+	if isinstance(value, (int, long)):
+		return value
+	return int(float(str(value)))
+
+
+def _to_float(value):
+	return float(str(value))
+
+
+def _write_varints(out, values):
+	for value in values:
+		while value > 0x7f:
+			out.append((value & 0x7f) | 0x80)
+			value >>= 7
+		out.append(value)
+
+
+def _read_varints(data, offset, n):
+	values = []
+	append = values.append
+	value = shift = 0
+	while len(values) < n:
+		byte = data[offset]
+		offset += 1
+		value |= (byte & 0x7f) << shift
+		if byte & 0x80:
+			shift += 7
+		else:
+			append(value)
+			value = shift = 0
+	return values, offset
+
+
+def _zigzag_deltas(values):
+	deltas = []
+	previous = 0
+	for value in values:
+		delta = value - previous
+		deltas.append(delta << 1 if delta >= 0 else ((-delta) << 1) - 1)
+		previous = value
+	return deltas
+
+
+def _unzigzag_sums(deltas):
+	values = []
+	value = 0
+	for delta in deltas:
+		value += -((delta + 1) >> 1) if delta & 1 else delta >> 1
+		values.append(value)
+	return values
+
+
+def _encode_character(char):
+	"""
+	Return the binary encoding of char or None if it can't be
+	encoded without loss, e.g. if only some points have a timestamp.
+	"""
+	writing = char.get_writing()
+	# empty strokes are dropped when reading characters anyway
+	strokes = [stroke for stroke in writing.get_strokes(full=True) if len(stroke) > 0]
+	points = [point for stroke in strokes for point in stroke]
+
+	flags = 0
+	channels = {}
+	for bit, key in enumerate(("x", "y") + _FLOAT_CHANNELS + ("timestamp",)):
+		values = [point[key] for point in points]
+		n_none = values.count(None)
+		if n_none == len(values) and key not in ("x", "y"):
+			continue
+		elif n_none > 0:
+			return None
+		channels[key] = values
+		if bit >= 2:
+			flags |= 1 << (bit - 1)
+
+	utf8 = char.get_utf8()
+	if isinstance(utf8, unicode):
+		utf8 = utf8.encode("utf8")
+	if utf8:
+		flags |= 1
+	try:
+		out = bytearray(BINARY_MAGIC)
+		out.append(BINARY_VERSION)
+		_write_varints(out, [flags])
+		if utf8:
+			_write_varints(out, [len(utf8)])
+			out.extend(utf8)
+		_write_varints(out, _zigzag_deltas([int(writing.get_width())]))
+		_write_varints(out, _zigzag_deltas([int(writing.get_height())]))
+		_write_varints(out, [len(strokes)] + [len(stroke) for stroke in strokes])
+		for key in ("x", "y", "timestamp"):
+			if key in channels:
+				_write_varints(out, _zigzag_deltas([_to_int(value) for value in channels[key]]))
+		for key in _FLOAT_CHANNELS:
+			if key in channels:
+				out.extend(struct.pack("<%dd" % len(points), *[_to_float(value) for value in channels[key]]))
+	except (TypeError, ValueError, struct.error):
+		return None
+	return str(out)
+
+
+def _decode_character(data, array_writing=False):
+	"""
+	Return the character of a binary encoding, see L{_encode_character}.
+
+	@param array_writing: whether the character holds an L{ArrayWriting}
+	"""
+	raw, data = data, bytearray(data)
+	if data[len(BINARY_MAGIC)] != BINARY_VERSION:
+		raise ValueError, "Unsupported character encoding version %d" % \
+		                  data[len(BINARY_MAGIC)]
+
+	(flags,), offset = _read_varints(data, len(BINARY_MAGIC) + 1, 1)
+	char = Character()
+	if flags & 1:
+		(length,), offset = _read_varints(data, offset, 1)
+		char.set_utf8(str(data[offset:offset + length]))
+		offset += length
+
+	(width, height, n_strokes), offset = _read_varints(data, offset, 3)
+	n_points, offset = _read_varints(data, offset, n_strokes)
+	total = sum(n_points)
+
+	channels = {}
+	for bit, key in ((0, "x"), (0, "y"), (4, "timestamp")):
+		if key in ("x", "y") or flags & (1 << bit):
+			deltas, offset = _read_varints(data, offset, total)
+			channels[key] = _unzigzag_sums(deltas)
+	for bit, key in enumerate(_FLOAT_CHANNELS):
+		if flags & (1 << (bit + 1)):
+			channels[key] = struct.unpack_from("<%dd" % total, raw, offset)
+			offset += 8 * total
+
+	if array_writing:
+		writing = ArrayWriting.from_columns(channels, n_points)
+		char.set_writing(writing)
+	else:
+		none = [None] * total
+		columns = [channels.get(key, none) for key in Point.KEYS]
+		points = [Point(*values) for values in zip(*columns)]
+
+		writing = char.get_writing()
+		start = 0
+		for n in n_points:
+			stroke = Stroke()
+			stroke.extend(points[start:start + n])
+			writing.append_stroke(stroke)
+			start += n
+	writing.set_width(_unzigzag_sums([width])[0])
+	writing.set_height(_unzigzag_sums([height])[0])
+	return char
+
+
+def _convert_character(data, array_writing=False):
 	# converts a BLOB into an object
+	data = str(data)
+	if data.startswith(BINARY_MAGIC):
+		return _decode_character(data, array_writing)
 	char = Character()
 	char.read_string(base64.b64decode(data), gzip=True)
+	if array_writing:
+		char.set_writing(ArrayWriting.from_writing(char.get_writing()))
 	return char
 
 
 def _adapt_character(char):
 	# converts an object into a BLOB
-	return base64.b64encode(char.write_string(gzip=True))
+	data = _encode_character(char)
+	if data is None:
+		return base64.b64encode(char.write_string(gzip=True))
+	return sqlite3.Binary(data)
+
+
+def _split_key(seed, charid):
+	# pseudo-random order of the characters of a split, see create_split
+	return int(hashlib.sha1("%s:%d" % (seed, charid)).hexdigest()[:15], 16)
 
 
 def _gzipbz2(path):
@@ -310,6 +501,12 @@ class CharacterCollection(_XmlBase):
 	#: However, there is probably overhead usigng them.
 	WRITE_BACK = True
 
+	#: With ARRAY_WRITINGS set to True, the characters read from the db
+	#: hold L{ArrayWriting} objects, which take less memory and can be
+	#: passed directly to the feature extractor, but changes to their
+	#: strokes and points are not reflected back to the db.
+	ARRAY_WRITINGS = False
+
 	def get_auto_commit(self):
 		return True if self._con.isolation_level is None else False
 
@@ -319,6 +516,9 @@ class CharacterCollection(_XmlBase):
 	#: With AUTO_COMMIT set to true, data is immediately written to disk
 	AUTO_COMMIT = property(get_auto_commit, set_auto_commit)
 
+	#: Number of characters inserted at once in bulk load mode, see L{bulk_load}
+	BULK_LOAD_BATCH_SIZE = 10000
+
 	DTD = \
 		"""
 		<!ELEMENT character-collection (set*)>
@@ -372,11 +572,13 @@ class CharacterCollection(_XmlBase):
 
 	def _e(self, req, *a, **kw):
 		self._charpool.clear_pool()
+		self._flush_bulk_rows(req)
 		#print req, a, kw
 		return self._c.execute(req, *a, **kw)
 
 	def _em(self, req, *a, **kw):
 		self._charpool.clear_pool()
+		self._flush_bulk_rows(req)
 		#print req, a, kw
 		return self._c.executemany(req, *a, **kw)
 
@@ -394,6 +596,19 @@ class CharacterCollection(_XmlBase):
 		self._e(req, *a, **kw)
 		return self._fa()
 
+	def _efa_by_ids(self, req, ids, params=()):
+		"""
+		Run req for chunks of ids and yield the rows of each chunk.
+
+		req is completed with the placeholders of the ids, e.g.
+		"SELECT * FROM characters WHERE charid IN (%s)", since sqlite
+		limits the number of parameters of a query.
+		params are the parameters before the ids.
+		"""
+		for i in range(0, len(ids), 500):
+			chunk = ids[i:i + 500]
+			yield self._efa(req % ",".join("?" * len(chunk)), list(params) + list(chunk))
+
 	def _has_tables(self):
 		self._e("SELECT count(type) FROM sqlite_master WHERE type = 'table'")
 		return self._fo()[0] > 0
@@ -410,7 +625,7 @@ CREATE TABLE characters(
   setid      INTEGER REFERENCES character_sets,
   utf8       TEXT,
   n_strokes  INTEGER,
-  data       BLOB, -- gz xml
+  data       BLOB, -- binary, see _encode_character, or base64 gz xml
   sha1       TEXT
 );
 
@@ -419,7 +634,7 @@ CREATE INDEX character_setid_index ON characters(setid);
 
 	def get_character_from_row(self, row):
 		# charid, setid, utf8, n_strokes, data, sha1
-		char = _convert_character(row['data'])
+		char = _convert_character(row['data'], self.ARRAY_WRITINGS)
 		char.charid = row['charid']
 		if self.WRITE_BACK:
 			return CharacterProxy(self._charpool, char)
@@ -459,6 +674,8 @@ CREATE INDEX character_setid_index ON characters(setid);
 		self._con.row_factory = _dict_factory  #sqlite3.Row
 		self._c = self._con.cursor()
 		self._charpool = _CharPool(self._c)
+		self._bulk_rows = None  # characters to insert in bulk load mode
+		self._bulk_load_state = None
 
 		if not self._has_tables():
 			self._create_tables()
@@ -480,8 +697,102 @@ CREATE INDEX character_setid_index ON characters(setid);
 		Commit changes since last commit.
 		"""
 		self._charpool.clear_pool()
+		self._flush_bulk_rows()
 		self._con.commit()
 
+	@contextlib.contextmanager
+	def bulk_load(self, journal_mode="MEMORY", verbose=True):
+		"""
+		Speed up adding many characters.
+
+		In bulk load mode, the db doesn't wait for the disk (synchronous
+		is off and the journal is in the given mode), the set index is
+		only rebuilt at the end, and the appended characters are inserted
+		by batches of BULK_LOAD_BATCH_SIZE, or before the next statement
+		on the characters table, in one transaction committed at the end,
+		even with AUTO_COMMIT. If the block raises an exception, the
+		changes since the last commit are rolled back instead.
+
+		>>> with charcol.bulk_load():
+		...     charcol.append_characters(set_name, characters)
+
+		@type journal_mode: str
+		@param journal_mode: "MEMORY", "WAL", which has to be copied to the
+		                     db at the end, or "OFF", which can't roll back
+		@type verbose: boolean
+		@param verbose: whether to print the number of characters
+		                added per second at the end
+		"""
+		self.begin_bulk_load(journal_mode)
+		try:
+			yield self
+		except:
+			self.end_bulk_load(verbose, rollback=True)
+			raise
+		self.end_bulk_load(verbose)
+
+	def begin_bulk_load(self, journal_mode="MEMORY"):
+		"""
+		Switch to bulk load mode, see L{bulk_load}.
+		"""
+		if self._bulk_load_state is not None:
+			raise ValueError, "The collection is already in bulk load mode"
+		self.commit()
+		self._bulk_load_state = (self._efo("PRAGMA journal_mode")[0],
+		                         self._efo("PRAGMA synchronous")[0], self.AUTO_COMMIT,
+		                         self.get_total_n_characters(), time.time())
+		self.AUTO_COMMIT = False
+		self._efo("PRAGMA journal_mode = %s" % journal_mode)
+		self._e("PRAGMA synchronous = OFF")
+		self._e("DROP INDEX IF EXISTS character_setid_index")
+		self._bulk_rows = []
+
+	def end_bulk_load(self, verbose=True, rollback=False):
+		"""
+		Leave bulk load mode, commit and rebuild the index,
+		see L{bulk_load}.
+
+		@type rollback: boolean
+		@param rollback: discard the changes since the last commit
+		                 instead of committing them
+		@rtype: float
+		@return: the number of characters added per second
+		"""
+		journal_mode, synchronous, auto_commit, n_characters, start = self._bulk_load_state
+		if rollback:
+			self._charpool.clear_pool()
+			self._bulk_rows = None
+			self._con.rollback()
+			self._update_set_ids()
+		else:
+			self.commit()
+			self._bulk_rows = None
+		self._bulk_load_state = None
+		self._e("""CREATE INDEX IF NOT EXISTS character_setid_index
+ON characters(setid);""")
+		self._efo("PRAGMA journal_mode = %s" % journal_mode)
+		self._e("PRAGMA synchronous = %d" % synchronous)
+		self.AUTO_COMMIT = auto_commit
+
+		n_added = self.get_total_n_characters() - n_characters
+		elapsed = time.time() - start
+		chars_per_sec = n_added / elapsed if elapsed > 0 else float("inf")
+		if verbose and not rollback:
+			print "bulk load: %d characters in %.2f s (%.0f chars/sec)" % \
+			      (n_added, elapsed, chars_per_sec)
+		return chars_per_sec
+
+	def _flush_bulk_rows(self, req=None):
+		# the characters buffered in bulk load mode are inserted before the
+		# statements which may depend on them, not before those on the sets
+		if self._bulk_rows and (req is None or "characters" in req or
+		                        req.lstrip().upper().startswith("DELETE")):
+			rows = self._bulk_rows
+			self._bulk_rows = []
+			self._c.executemany("""INSERT INTO
+characters (setid, utf8, n_strokes, data, sha1)
+VALUES (?,?,?,?,?)""", rows)
+
 	def save(self, path=None):
 		"""
 		Save collection to a file.
@@ -507,9 +818,8 @@ CREATE INDEX character_setid_index ON characters(setid);
 		else:
 			if path.endswith(".chardb"):
 				if self._dbpath != path:
-					# the collection changed its database name
-					# FIXME: this can rewritten more efficiently with
-					# the ATTACH command
+					# the collection changed its database name,
+					# merge copies the rows with the ATTACH command
 					if os.path.exists(path):
 						os.unlink(path)
 					newcc = CharacterCollection(path)
@@ -606,15 +916,30 @@ CREATE INDEX character_setid_index ON characters(setid);
 		"""
 		Merge several charcacter collections into the current collection.
 
+		Unless check_duplicate is set, sqlite copies the characters from
+		one database to the other with ATTACH DATABASE when either
+		collection is stored in a file. The collections are committed
+		in that case, so the characters are copied through Python in
+		bulk load mode, see L{bulk_load}, which rolls them back with the
+		rest of the block.
+
 		@type charcols: list
 		@param charcols: a list of CharacterCollection to merge
 		"""
 
 		try:
-			# it's faster to delete the whole index and rewrite it afterwards
-			self._e("""DROP INDEX character_setid_index;""")
+			# it's faster to delete the whole index and rewrite it afterwards,
+			# bulk_load already did (and the DDL would commit)
+			if self._bulk_load_state is None:
+				self._e("""DROP INDEX IF EXISTS character_setid_index;""")
 
 			for charcol in charcols:
+				# ATTACH would commit the bulk load transactions
+				attach = not check_duplicate and self._bulk_load_state is None and \
+				         charcol._bulk_load_state is None
+				if attach and self._merge_attached(charcol):
+					continue
+
 				for set_name in charcol.get_set_list():
 					self.add_set(set_name)
 
@@ -628,9 +953,55 @@ CREATE INDEX character_setid_index ON characters(setid);
 						self.append_character_rows(set_name, chars)
 
 		finally:
-			self._e("""CREATE INDEX character_setid_index
+			if self._bulk_load_state is None:
+				self._e("""CREATE INDEX character_setid_index
 ON characters(setid);""")
 
+	def _merge_attached(self, charcol):
+		"""
+		Append the sets and characters of charcol with INSERT ... SELECT
+		queries, the set ids being mapped by set name.
+
+		@rtype: boolean
+		@return: False if neither collection is stored in a file
+		"""
+		path = charcol.get_db_filename()
+		if path is not None and path != self.get_db_filename():
+			# attach charcol to the current collection
+			con, names = self, {"src": "merged", "dst": "main"}
+		elif path is None and self.get_db_filename() is not None:
+			# attach the current collection to charcol
+			con, names = charcol, {"src": "main", "dst": "merged"}
+			path = self.get_db_filename()
+		else:
+			return False
+
+		# ATTACH and DETACH can't be run in transactions, the other
+		# connection only sees the committed rows
+		self.commit()
+		charcol.commit()
+		con._e("ATTACH DATABASE ? AS merged", (path,))
+		try:
+			con._e("""INSERT INTO %(dst)s.character_sets (name)
+SELECT name FROM %(src)s.character_sets
+WHERE name NOT IN (SELECT name FROM %(dst)s.character_sets)
+ORDER BY setid""" % names)
+			con._e("""INSERT INTO %(dst)s.characters (setid, utf8, n_strokes, data, sha1)
+SELECT d.setid, c.utf8, c.n_strokes, c.data, c.sha1
+FROM %(src)s.characters c
+JOIN %(src)s.character_sets s ON s.setid = c.setid
+JOIN %(dst)s.character_sets d ON d.name = s.name
+ORDER BY s.setid, c.charid""" % names)
+			con.commit()
+		except:
+			con._con.rollback()
+			raise
+		finally:
+			con._e("DETACH DATABASE merged")
+
+		self._update_set_ids()
+		return True
+
 	def __add__(self, other):
 		return self.concatenate(other)
 
@@ -717,23 +1088,47 @@ ON characters(setid);""")
 WHERE setid=? ORDER BY charid LIMIT ? OFFSET ?""", (i, int(limit), int(offset)))
 		return self._fa()
 
-	def get_random_characters(self, n):
+	def get_random_characters(self, n, seed=None, chunk_size=500):
 		"""
 		Return characters at random.
 
 		@type n: int
 		@param n: number of random characters needed.
+		@param seed: see L{get_random_charids}
+		@type chunk_size: int
+		@param chunk_size: number of characters read from the db at once
 		"""
-		return list(self.get_random_characters_gen(n))
+		return list(self.get_random_characters_gen(n, seed, chunk_size))
 
-	def get_random_characters_gen(self, n):
+	def get_random_characters_gen(self, n, seed=None, chunk_size=500):
 		"""
 		Return a generator to iterate over random characters. See \
 		L{get_random_characters).
+
+		Only the characters of the current chunk are kept in memory.
 		"""
-		self._e("""SELECT DISTINCT * from characters
-ORDER BY RANDOM() LIMIT ?""", (int(n),))
-		return (self.get_character_from_row(r) for r in self._fa())
+		charids = self.get_random_charids(n, seed)
+		chunks = (charids[i:i + chunk_size] for i in range(0, len(charids), chunk_size))
+		return (char for chunk in chunks for char in self.get_characters_by_ids(chunk))
+
+	def get_random_charids(self, n=-1, seed=None):
+		"""
+		Return the ids of characters drawn at random.
+
+		Only the ids are shuffled, the rows aren't sorted by the db.
+		The same seed draws the same characters, in the same order,
+		as long as the collection doesn't change.
+
+		@type n: int
+		@param n: number of random characters needed or -1 if all
+		@param seed: seed of the random generator or None
+		@rtype: list of int
+		"""
+		charids = self.get_charids()
+		random.Random(seed).shuffle(charids)
+		if n >= 0:
+			charids = charids[:int(n)]
+		return charids
 
 	def get_n_characters(self, set_name):
 		"""
@@ -775,6 +1170,233 @@ WHERE setid=?""", (i,))[0]
 ORDER BY charid LIMIT ? OFFSET ?""", (int(limit), int(offset)))
 		return (self.get_character_from_row(r) for r in self._fa())
 
+	def get_charids(self):
+		"""
+		Return the ids of all the characters in collection.
+
+		@rtype: list of int
+		"""
+		return [row['charid'] for row in self._efa("SELECT charid FROM characters ORDER BY charid")]
+
+	def get_characters_by_ids(self, charids):
+		"""
+		Return the characters with the given ids, in the same order.
+		Ids of characters not in collection are skipped.
+
+		@type charids: list of int
+		@rtype: list of L{Character}
+		"""
+		rows = {}
+		for chunk_rows in self._efa_by_ids("SELECT * FROM characters WHERE charid IN (%s)", charids):
+			for row in chunk_rows:
+				rows[row['charid']] = row
+		return [self.get_character_from_row(rows[charid]) for charid in charids if charid in rows]
+
+	# Feature cache
+
+	def _has_feature_table(self):
+		# collections created before the cache don't have the table
+		self._e("""SELECT count(name) FROM sqlite_master
+WHERE type = 'table' AND name = 'features'""")
+		return self._fo()[0] > 0
+
+	def _create_feature_table(self):
+		self._c.executescript("""
+CREATE TABLE features(
+  charid       INTEGER REFERENCES characters,
+  sha1         TEXT, -- sha1 of the character the features were extracted from
+  fingerprint  TEXT, -- configuration of the feature extractor
+  n_features   INTEGER,
+  data         BLOB, -- little-endian float32 feature vectors
+  PRIMARY KEY(charid, fingerprint)
+);
+""")
+
+	def get_cached_features(self, charids, fingerprint):
+		"""
+		Return the cached features of the characters which didn't change
+		since their features were stored.
+
+		@type charids: list of int
+		@type fingerprint: str
+		@param fingerprint: identifies the configuration of the feature extractor
+		@rtype: dict
+		@return: {charid: (utf8, n_features, data)}
+		"""
+		cached = {}
+		if not self._has_feature_table():
+			return cached
+		for rows in self._efa_by_ids("""SELECT f.charid, c.utf8, f.n_features, f.data
+FROM features f JOIN characters c ON c.charid = f.charid AND c.sha1 = f.sha1
+WHERE f.fingerprint = ? AND f.charid IN (%s)""", charids, [fingerprint]):
+			for row in rows:
+				cached[row['charid']] = (row['utf8'], row['n_features'], str(row['data']))
+		return cached
+
+	def set_cached_features(self, features, fingerprint):
+		"""
+		Store the features of characters, with the sha1 of the characters.
+
+		@type features: list of (charid, n_features, data)
+		@type fingerprint: str
+		"""
+		if not self._has_feature_table():
+			self._create_feature_table()
+		self._em("""INSERT OR REPLACE INTO features
+SELECT charid, sha1, ?, ?, ? FROM characters WHERE charid = ?""",
+		         [(fingerprint, n_features, sqlite3.Binary(data), charid)
+		          for charid, n_features, data in features])
+
+	def clear_feature_cache(self):
+		"""
+		Remove all the cached features.
+		"""
+		if self._has_feature_table():
+			self._e("DELETE FROM features")
+
+	# Splits
+
+	def _has_split_table(self):
+		self._e("""SELECT count(name) FROM sqlite_master
+WHERE type = 'table' AND name = 'splits'""")
+		return self._fo()[0] > 0
+
+	def _create_split_table(self):
+		self._c.executescript("""
+CREATE TABLE splits(
+  name     TEXT,
+  part     TEXT, -- e.g. train, validation or test
+  charid   INTEGER REFERENCES characters,
+  key      INTEGER, -- pseudo-random order of the characters
+  PRIMARY KEY(name, charid)
+);
+
+CREATE INDEX split_part_index ON splits(name, part, key);
+""")
+
+	def create_split(self, name, parts, seed=None, stratify_by_set=False):
+		"""
+		Split the characters in parts that have the same proportion of
+		each label, and store the split in the db.
+
+		The characters of each label are ordered by a hash of their charid
+		and the seed, and each part takes a range of that order. Only
+		sqlite queries are run, the characters aren't read. A split
+		with the same name is replaced.
+
+		@type name: str
+		@type parts: list of (part_name, fraction)
+		@param parts: e.g. [("train", 0.6), ("validation", 0.2), ("test", 0.2)],
+		              if the fractions add up to less than 1 the remaining
+		              characters are in no part
+		@param seed: seed of the hash, the same seed splits a collection
+		             the same way, None for a random one
+		@type stratify_by_set: boolean
+		@param stratify_by_set: also keep the proportion of each set in
+		                        every part, for sets grouping characters
+		                        by writer or source
+		"""
+		if seed is None:
+			seed = random.getrandbits(32)
+		if not self._has_split_table():
+			self._create_split_table()
+		self._con.create_function("split_key", 2, _split_key)
+
+		self._e("DELETE FROM splits WHERE name = ?", (name,))
+		self._e("DROP TABLE IF EXISTS temp.split_order")
+		self._e("""CREATE TEMP TABLE split_order(
+  position INTEGER PRIMARY KEY,
+  charid   INTEGER,
+  utf8     TEXT,
+  setid    INTEGER,
+  key      INTEGER
+)""")
+		self._e("""INSERT INTO split_order (charid, utf8, setid, key)
+SELECT charid, coalesce(utf8, ''), %s, split_key(?, charid) AS key
+FROM characters ORDER BY 2, 3, key""" % ("setid" if stratify_by_set else "0"), (str(seed),))
+
+		# the characters of a label (and set) have consecutive positions
+		# and go to the first part whose bound their rank is under
+		cases = []
+		params = [name]
+		total = 0.0
+		for part_name, fraction in parts:
+			total += fraction
+			cases.append("WHEN o.position - s.first < round(s.n * ?) THEN ?")
+			params.extend([1.0 if abs(total - 1.0) < 1e-9 else total, part_name])
+		self._e("""INSERT INTO splits (name, part, charid, key)
+SELECT ?, part, charid, key FROM (
+  SELECT o.charid, o.key, CASE %s END AS part
+  FROM split_order o JOIN (SELECT utf8, setid, min(position) AS first, count(*) AS n
+                           FROM split_order GROUP BY utf8, setid) s
+  ON o.utf8 = s.utf8 AND o.setid = s.setid)
+WHERE part IS NOT NULL""" % " ".join(cases), params)
+		self._e("DROP TABLE temp.split_order")
+
+	def has_split(self, name):
+		"""
+		Return whether a split with that name is stored, see L{create_split}.
+
+		@rtype: boolean
+		"""
+		if not self._has_split_table():
+			return False
+		return self._efo("SELECT count(*) FROM splits WHERE name = ?", (name,))[0] > 0
+
+	def get_split_charids(self, name, part):
+		"""
+		Return the ids of the characters of a part of a split,
+		in pseudo-random order. Characters added to the collection
+		after the split was created aren't in any part.
+
+		@type name: str
+		@type part: str
+		@rtype: list of int
+		"""
+		if not self._has_split_table():
+			return []
+		return [row['charid'] for row in self._efa("""SELECT s.charid FROM splits s
+JOIN characters c ON c.charid = s.charid
+WHERE s.name = ? AND s.part = ? ORDER BY s.key, s.charid""", (name, part))]
+
+	def remove_split(self, name):
+		"""
+		Remove a split, see L{create_split}.
+		"""
+		if self._has_split_table():
+			self._e("DELETE FROM splits WHERE name = ?", (name,))
+
+	# Data format
+
+	def upgrade_data_format(self, vacuum=True):
+		"""
+		Rewrite the characters stored as base64 gzipped XML with the
+		binary encoding, which is smaller and faster to read.
+
+		Characters that the binary encoding can't represent are left as is.
+
+		@type vacuum: boolean
+		@param vacuum: whether to shrink the db file afterwards
+		@rtype: int
+		@return: the number of characters rewritten
+		"""
+		n_rewritten = 0
+		charids = [row['charid'] for row in
+		           self._efa("SELECT charid FROM characters WHERE typeof(data) = 'text'")]
+		for rows in self._efa_by_ids("SELECT charid, data FROM characters WHERE charid IN (%s)", charids):
+			updates = []
+			for row in rows:
+				data = _encode_character(_convert_character(row['data']))
+				if data is not None:
+					updates.append((sqlite3.Binary(data), row['charid']))
+			self._em("UPDATE characters SET data=? WHERE charid=?", updates)
+			n_rewritten += len(updates)
+		self.commit()
+
+		if vacuum:
+			self._e("VACUUM")
+		return n_rewritten
+
 	def get_total_n_characters(self):
 		"""
 		Return the total number of characters in collection.
@@ -837,6 +1459,13 @@ WHERE setid=?""", (i,))[0]
 		tupls = [(i, r['utf8'], r['n_strokes'], r['data'], r['sha1']) \
 		         for r in rows]
 
+		if self._bulk_rows is not None:
+			# inserted with the next statement, see bulk_load
+			self._bulk_rows.extend(tupls)
+			if len(self._bulk_rows) >= self.BULK_LOAD_BATCH_SIZE:
+				self._flush_bulk_rows()
+			return
+
 		self._em("""INSERT INTO
 characters (setid, utf8, n_strokes, data, sha1)
 VALUES (?,?,?,?,?)""", tupls)
@@ -1132,4 +1761,13 @@ FROM characters GROUP BY setid""")
 		if self._tag == "width":
 			self._curr_width = int(data)
 		elif self._tag == "height":
-			self._curr_height = int(data)
\ No newline at end of file
+			self._curr_height = int(data)
+
+
+if __name__ == "__main__":
+	# rewrite the given .chardb files with the binary character encoding
+	for path in sys.argv[1:]:
+		size = os.path.getsize(path)
+		n_rewritten = CharacterCollection(path).upgrade_data_format()
+		print "%s: %d characters rewritten, %d -> %d bytes" % \
+		      (path, n_rewritten, size, os.path.getsize(path))
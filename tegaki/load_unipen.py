@@ -11,43 +11,47 @@ def unipen_to_sqlite():
 	"""
 	Loads the unipen training set and saved each db to an sqlite file.
 	"""
-	databases = {}  # databases(charcol) indexed by their name. {db_name(str): charcol(CharacterCollection), ..}
-	skipped_files = []
+	files_by_db = {}  # .dat files indexed by the name of their db. {db_name(str): [filepath(str), ..], ..}
 	for root, dirs, files in os.walk(digits_dir):
 		# print root
 		for file in files:
 			if os.path.splitext(file)[1] != ".dat":
 				continue
 
-			filepath = os.path.join(root, file)
-
 			db_name = os.path.relpath(root, digits_dir).replace(os.sep, ".")
+			files_by_db.setdefault(db_name, []).append(os.path.join(root, file))
 
-			# add database entry if it doesn't exist
-			if db_name not in databases:
-				databases[db_name] = CharacterCollection()
-
-			print 'parsing', filepath
-			up = UnipenParser()
-			up.parse_file(filepath, include_dir)
-			try:
-				charcol = up.get_character_collection()
-				databases[db_name].merge([charcol])
-			except IndexError:
-				skipped_files.append(filepath)
+	databases = {}  # databases(charcol) indexed by their name. {db_name(str): charcol(CharacterCollection), ..}
+	skipped_files = []
+	for db_name, filepaths in files_by_db.iteritems():
+		databases[db_name] = CharacterCollection()
+		print "loading", db_name
+		with databases[db_name].bulk_load():
+			for filepath in filepaths:
+				print 'parsing', filepath
+				up = UnipenParser()
+				up.parse_file(filepath, include_dir)
+				try:
+					charcol = up.get_character_collection()
+					databases[db_name].merge([charcol])
+				except IndexError:
+					skipped_files.append(filepath)
 
 	for file in skipped_files:
 		print file
 
 	# merge db's from the same source, eg. apa01-apa20 ==> apa
-	merged_databases = {}
-	for db_name, db in databases.iteritems():
+	merged_names = {}  # {merged_db_name(str): [db_name(str), ..], ..}
+	for db_name in databases.keys():
 		if db_name.find('.') != -1:
-			merged_db_name = db_name.split('.')[0]
-			# add database entry if it doesn't exist
-			if merged_db_name not in merged_databases:
-				merged_databases[merged_db_name] = CharacterCollection()
-			merged_databases[merged_db_name].merge([db])
+			merged_names.setdefault(db_name.split('.')[0], []).append(db_name)
+
+	merged_databases = {}
+	for merged_db_name, db_names in merged_names.iteritems():
+		merged_databases[merged_db_name] = CharacterCollection()
+		print "loading", merged_db_name
+		with merged_databases[merged_db_name].bulk_load():
+			merged_databases[merged_db_name].merge([databases[db_name] for db_name in db_names])
 	databases = dict(databases.items() + merged_databases.items())
 
 	if not os.path.exists("unipen_db"):
@@ -102,10 +106,14 @@ def group_best():
 		# print db_name, charcol.get_total_n_characters()
 		charcols.append(charcol)
 
-	charcol_best = CharacterCollection()
+	# merge straight into the file, sqlite copies the rows of each db
+	best_path = "unipen_db/best_1c.chardb"
+	if os.path.exists(best_path):
+		os.unlink(best_path)
+	charcol_best = CharacterCollection(best_path)
 	charcol_best.merge(charcols)
 	print charcol_best.get_total_n_characters()
-	charcol_best.save("unipen_db/best_1c.chardb")
+	charcol_best.commit()
 
 # unipen_to_sqlite()
 # group_unipen_db()
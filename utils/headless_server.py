@@ -0,0 +1,403 @@
+import argparse
+import collections
+import multiprocessing
+import threading
+import Queue
+
+from twisted.internet.protocol import Protocol, Factory
+from twisted.internet import defer, reactor, task, threads
+from twisted.python import failure
+
+from tegaki.character import ArrayWriting, Character, Writing
+from tegaki.charcol import CharacterCollection
+from recognition import wire_protocol
+from recognition.recognizer import RecognitionPool
+from recognition.recognition_cache import RecognitionCache
+
+
+class RecognitionBatcher(object):
+	"""
+	Groups the recognition requests arriving within a short window
+	and sends them to the recognition pool as one batch
+	(one network pass per writing type).
+	"""
+
+	def __init__(self, recognition_pool, window=0.003, max_batch_size=32, cache=None):
+		"""
+		@param window: seconds to wait for more requests after the first one
+		@param max_batch_size: the batch is sent as soon as it has that many requests
+		@type cache: L{RecognitionCache}
+		@param cache: results of previous requests or None
+		"""
+		self.recognition_pool = recognition_pool
+		self.cache = cache
+		self.window = window
+		self.max_batch_size = max_batch_size
+		self._pending = []  # [(writing, writing_type, deferred), ..]
+		self._flush_call = None
+
+		self.n_requests = 0
+		self.n_batches = 0
+		self.n_in_flight = 0  # requests sent to the pool and not answered yet
+		self.max_seen_batch_size = 0
+
+	def recognize(self, writing, writing_type):
+		"""
+		@rtype: Deferred firing with the ranking of the writing,
+		        see L{recognition.recognizer.Recognizer.rank}
+		"""
+		if self.cache is None:
+			return self._enqueue(writing, writing_type, None)
+
+		# the digest normalizes the writing, keep it off the reactor thread
+		d = threads.deferToThread(self.cache.get_key, writing, writing_type)
+		d.addCallback(self._keyComputed, writing, writing_type)
+		return d
+
+	def _keyComputed(self, key, writing, writing_type):
+		if key is not None:
+			ranking = self.cache.get(key)
+			if ranking is not None:
+				return ranking
+		return self._enqueue(writing, writing_type, key)
+
+	def _enqueue(self, writing, writing_type, key):
+		d = defer.Deferred()
+		if key is not None:
+			d.addCallback(self._cacheRanking, key)
+		self._pending.append((writing, writing_type, d))
+		self.n_requests += 1
+
+		if len(self._pending) >= self.max_batch_size:
+			self.flush()
+		elif self._flush_call is None:
+			self._flush_call = reactor.callLater(self.window, self.flush)
+		return d
+
+	def flush(self):
+		"""
+		Send the pending requests to the recognition pool.
+		"""
+		if self._flush_call is not None and self._flush_call.active():
+			self._flush_call.cancel()
+		self._flush_call = None
+
+		batch, self._pending = self._pending, []
+		if not batch:
+			return
+		self.n_batches += 1
+		self.n_in_flight += len(batch)
+		self.max_seen_batch_size = max(self.max_seen_batch_size, len(batch))
+
+		requests = [(writing, writing_type) for writing, writing_type, _ in batch]
+		d = threads.deferToThread(self.recognition_pool.recognize_batch, requests)
+		d.addBoth(self._batchRecognized, batch)
+
+	def _batchRecognized(self, results, batch):
+		self.n_in_flight -= len(batch)
+		if isinstance(results, failure.Failure):
+			# the whole batch failed, e.g. a worker died
+			results = [results] * len(batch)
+
+		for (_, _, d), result in zip(batch, results):
+			if isinstance(result, Exception):
+				d.errback(failure.Failure(result))
+			else:
+				d.callback(result)
+
+	def _cacheRanking(self, ranking, key):
+		self.cache.set(key, ranking)
+		return ranking
+
+	def get_metrics(self):
+		"""
+		@rtype: dict
+		"""
+		metrics = {'queue_depth': len(self._pending),
+		           'in_flight': self.n_in_flight,
+		           'requests': self.n_requests,
+		           'batches': self.n_batches,
+		           'average_batch_size': self.n_requests / float(self.n_batches) if self.n_batches else 0.0,
+		           'max_batch_size': self.max_seen_batch_size}
+		if self.cache is not None:
+			metrics.update(self.cache.get_metrics())
+		return metrics
+
+	def print_metrics(self):
+		metrics = self.get_metrics()
+		print "metrics", " ".join("%s=%s" % (key, metrics[key]) for key in sorted(metrics.keys()))
+
+
+class SampleCollector(object):
+	"""
+	Appends the recognized writings to a .chardb collection, one set per label.
+
+	Characters are buffered and written in batches by a background thread,
+	so the reactor never waits for the disk.
+	"""
+
+	def __init__(self, path, batch_size=100):
+		"""
+		@type path: str
+		@param path: the .chardb file, created if it doesn't exist
+		@param batch_size: number of characters buffered before they are written
+		"""
+		self.path = path
+		self.batch_size = batch_size
+		self._buffer = []
+		self._queue = Queue.Queue()
+		# sqlite connections can only be used by the thread that created them
+		self._thread = threading.Thread(target=self._write_batches)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def add(self, label, writing):
+		"""
+		@type label: str
+		@type writing: L{Writing} or L{ArrayWriting}
+		"""
+		char = Character()
+		char.set_utf8(label)
+		char.set_writing(writing)
+		self._buffer.append(char)
+		if len(self._buffer) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		"""
+		Hand the buffered characters to the writer thread.
+		"""
+		if self._buffer:
+			self._queue.put(self._buffer)
+			self._buffer = []
+
+	def close(self):
+		"""
+		Write the remaining characters and stop the writer thread.
+		"""
+		self.flush()
+		self._queue.put(None)
+		self._thread.join()
+
+	def _write_batches(self):
+		charcol = CharacterCollection(self.path)
+		while True:
+			chars = self._queue.get()
+			if chars is None:
+				break
+
+			sets = {}
+			for char in chars:
+				sets.setdefault(char.get_utf8(), []).append(char)
+			charcol.add_sets(sets.keys())
+			for set_name, set_chars in sets.items():
+				charcol.append_characters(set_name, set_chars)
+			charcol.commit()
+
+
+def writing_from_strokes(strokes):
+	"""
+	Return the writing of the coordinate arrays of a binary frame,
+	see L{recognition.wire_protocol.decode_strokes}.
+
+	@rtype: L{ArrayWriting}
+	"""
+	columns = {"x": [], "y": []}
+	for xs, ys in strokes:
+		columns["x"].extend(xs.tolist())
+		# flip y like Writing.from_xml
+		columns["y"].extend((-ys).tolist())
+	return ArrayWriting.from_columns(columns, [len(xs) for xs, _ in strokes])
+
+
+class WritingRecognizerProtocol(Protocol):
+	def connectionMade(self):
+		self.log("Client connected!")
+		self.transport.write("""connected""")
+		self.factory.clients.append(self)
+		self.complete_message = ''
+		# replies to the requests without id, in request order, [done, reply]
+		self.ordered_replies = collections.deque()
+
+	# print "clients are ", self.factory.clients
+
+	def connectionLost(self, reason):
+		self.factory.clients.remove(self)
+
+	def dataReceived(self, data):
+		"""
+		Messages are either XML writings or binary frames (see
+		recognition.wire_protocol) and may be pipelined on the connection.
+
+		XML writings may have an id attribute and a topk attribute, the
+		number of labels to reply with their scores. Requests with an id are
+		answered as soon as they are recognized with "<id> <reply>" or
+		"<id> ERROR <message>", the others in the order they were received
+		with "<reply>" or "ERROR <message>". Messages which can't be parsed
+		are answered like requests without id.
+		"""
+		self.complete_message += data
+		while True:
+			self.complete_message = self.complete_message.lstrip()
+			if not self.complete_message:
+				return
+
+			if self.complete_message.startswith('<'):
+				end = self.complete_message.find('</writing>')
+				if end == -1:
+					return
+				end += len('</writing>')
+				message, self.complete_message = self.complete_message[:end], self.complete_message[end:]
+				try:
+					writing, attributes = Writing.from_xml_with_attributes(message)
+					writing_type = attributes['type']
+					request_id = attributes.get('id')
+					top_k = int(attributes.get('topk', 0))
+					if request_id is not None and (not request_id or len(request_id.split()) != 1):
+						raise ValueError("Invalid request id %r" % request_id)
+					if top_k < 0:
+						raise ValueError("Invalid topk %d" % top_k)
+				except Exception as e:
+					# ParseError, or any error of a malformed writing
+					self.parsingFailed(e)
+					continue
+			else:
+				try:
+					version, payload, self.complete_message = wire_protocol.read_frame(self.complete_message)
+				except ValueError as e:
+					# the stream can't be resynchronized
+					print 'Error:', str(e)
+					self.transport.loseConnection()
+					return
+				if payload is None:
+					return
+				try:
+					writing_type, strokes, request_id, top_k = wire_protocol.decode_strokes(payload, version)
+					writing = writing_from_strokes(strokes)
+				except Exception as e:
+					self.parsingFailed(e)
+					continue
+
+			self.log('received', writing_type, 'writing,', writing.get_n_strokes(), 'strokes,',
+			         writing.get_n_points(), 'points')
+			# recognize in the worker pool, the reactor keeps serving other clients
+			reply = None
+			if request_id is None:
+				reply = [False, None]
+				self.ordered_replies.append(reply)
+			d = self.factory.recognition_batcher.recognize(writing, writing_type)
+			d.addCallback(self.rankingReceived, writing, request_id, top_k, reply)
+			d.addErrback(self.recognitionFailed, request_id, reply)
+
+	def rankingReceived(self, ranking, writing, request_id, top_k, reply):
+		self.writingRecognized(ranking[0][0], writing)
+
+		if top_k > 0:
+			message = " ".join("%s %.6f" % (label, score) for label, score in ranking[:top_k])
+		else:
+			message = ranking[0][0]
+		self.reply(request_id, reply, message)
+
+	def writingRecognized(self, label, writing):
+		if self.factory.sample_collector is not None:
+			self.factory.sample_collector.add(label, writing)
+
+	def recognitionFailed(self, failure, request_id, reply):
+		self.log('Error:', failure.getErrorMessage())
+		self.reply(request_id, reply, "ERROR " + " ".join(failure.getErrorMessage().split()))
+
+	def parsingFailed(self, error):
+		self.log('Error:', error)
+		reply = [False, None]
+		self.ordered_replies.append(reply)
+		self.reply(None, reply, "ERROR " + " ".join(str(error).split()))
+
+	def reply(self, request_id, reply, message):
+		"""
+		Send the reply to a request, see dataReceived.
+
+		@param reply: the entry of ordered_replies of requests without id
+		"""
+		if request_id is not None:
+			self.message("%s %s" % (request_id, message))
+			return
+
+		reply[:] = True, message
+		while self.ordered_replies and self.ordered_replies[0][0]:
+			_, message = self.ordered_replies.popleft()
+			self.message(message)
+
+	def message(self, message):
+		self.log("sending", message)
+		self.transport.write(message + '\n')
+
+	def log(self, *values):
+		"""
+		Print the values with --verbose.
+		"""
+		if self.factory.verbose:
+			print " ".join(str(value) for value in values)
+
+
+def create_argument_parser():
+	parser = argparse.ArgumentParser(description='Handwritten character recognition server.')
+	parser.add_argument('--port', type=int, default=1234)
+	parser.add_argument('--networks-dir', default='saved_networks')
+	parser.add_argument('--workers', type=int, default=None,
+	                    help='number of recognition processes (default: one per cpu, 0: recognize in the server process)')
+	parser.add_argument('--batch-window', type=float, default=3,
+	                    help='milliseconds to wait for more requests to recognize together')
+	parser.add_argument('--max-batch-size', type=int, default=32)
+	parser.add_argument('--metrics-interval', type=float, default=60,
+	                    help='seconds between metrics reports, 0 to disable')
+	parser.add_argument('--cache-size', type=int, default=10000,
+	                    help='number of recognition results cached, 0 to disable the cache')
+	parser.add_argument('--cache-ttl', type=float, default=300,
+	                    help='seconds a cached recognition result stays valid')
+	parser.add_argument('--samples', default=None,
+	                    help='.chardb file to append the recognized writings to')
+	parser.add_argument('--samples-interval', type=float, default=10,
+	                    help='seconds between writes of the recognized writings')
+	parser.add_argument('--verbose', action='store_true',
+	                    help='print every request and reply')
+	return parser
+
+
+def create_factory(args, protocol=WritingRecognizerProtocol):
+	"""
+	Build the server factory and its recognition pool from the parsed arguments.
+	"""
+	factory = Factory()
+	factory.protocol = protocol
+	factory.clients = []
+	factory.verbose = args.verbose
+	# parse all the networks once in every worker, requests are routed to them by writing type
+	factory.recognition_pool = RecognitionPool(args.networks_dir, args.workers)
+	cache = RecognitionCache(args.cache_size, args.cache_ttl) if args.cache_size > 0 else None
+	factory.recognition_batcher = RecognitionBatcher(factory.recognition_pool,
+	                                                 args.batch_window / 1000.0, args.max_batch_size, cache)
+	reactor.addSystemEventTrigger('before', 'shutdown', factory.recognition_pool.close)
+	if args.metrics_interval > 0:
+		task.LoopingCall(factory.recognition_batcher.print_metrics).start(args.metrics_interval, now=False)
+
+	factory.sample_collector = None
+	if args.samples is not None:
+		factory.sample_collector = SampleCollector(args.samples)
+		task.LoopingCall(factory.sample_collector.flush).start(args.samples_interval, now=False)
+		reactor.addSystemEventTrigger('before', 'shutdown', factory.sample_collector.close)
+
+	# every recognition in flight holds a reactor thread while it waits for its worker
+	reactor.suggestThreadPoolSize((args.workers or multiprocessing.cpu_count()) * 2)
+
+	return factory
+
+
+def run(args, protocol=WritingRecognizerProtocol):
+	factory = create_factory(args, protocol)
+	port = reactor.listenTCP(args.port, factory)
+	print "Recognition server started on port", port.getHost().port
+	reactor.run()
+
+
+if __name__ == '__main__':
+	run(create_argument_parser().parse_args())